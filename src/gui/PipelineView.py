@@ -49,7 +49,7 @@ class PipelineView(QWidget):
         self.scripts = [
             ("Downloading Satellite Imagery", "scripts/get-imagery.py"),
             ("Combining and Clipping Tiles", "scripts/combine-tiles.py"),
-            ("Generating Land Cover Map", "scripts/use.py"),
+            ("Generating Land Cover Map", "scripts/submit-job.py"),
             ("Fine Tuning Model", "scripts/train.py"),
             ("Generating Areas", "scripts/extract-areas.py"),
             ("Transferring to Backend", "scripts/transfer-file.py"),
@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+import rasterio
+import torch
+from use import (
+    RAW_PATH,
+    CHECKPOINT_PATH,
+    PATCH_SIZE,
+    BACKENDS,
+    PRECISIONS,
+    TUNED_SETTINGS,
+    profile_path,
+    sample_windows,
+)
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Real patches copied out of the input, enough for a few batches per run
+SAMPLE_PATCHES = 32
+SAMPLE_COLUMNS = 8
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32]
+INTER_OP_THREADS = [1, 2]
+
+# Fraction of physical memory a configuration may use at its peak
+MEMORY_FRACTION = 0.75
+
+
+def total_memory_mb():
+    """Physical memory in MB, None where sysconf can't tell"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**2
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def thread_counts(cpu_count):
+    """Powers of two up to the core count, plus the core count itself"""
+    counts = []
+    count = 1
+    while count < cpu_count:
+        counts.append(count)
+        count *= 2
+    return counts + [cpu_count]
+
+
+def worker_counts(cpu_count):
+    """Worker counts that leave each worker at least two threads"""
+    return [1] + [w for w in thread_counts(cpu_count) if 1 < w <= cpu_count // 2]
+
+
+def write_sample_raster(input_path, sample_path, num_patches):
+    """Mosaic of num_patches real patches, so tuning runs don't read the region"""
+    with rasterio.open(input_path) as src:
+        windows = sample_windows(src, num_patches)
+        rows = -(-len(windows) // SAMPLE_COLUMNS)
+        columns = min(len(windows), SAMPLE_COLUMNS)
+        profile = src.profile.copy()
+        profile.update(
+            width=columns * PATCH_SIZE,
+            height=rows * PATCH_SIZE,
+            tiled=True,
+            blockxsize=PATCH_SIZE,
+            blockysize=PATCH_SIZE,
+        )
+        fill = src.nodata if src.nodata is not None else 0
+        with rasterio.open(sample_path, "w", **profile) as dst:
+            for i, window in enumerate(windows):
+                # Edge windows are padded with nodata up to a full patch
+                patch = np.full(
+                    (src.count, PATCH_SIZE, PATCH_SIZE), fill, dtype=src.dtypes[0]
+                )
+                patch[:, : window.height, : window.width] = src.read(window=window)
+                row, col = divmod(i, SAMPLE_COLUMNS)
+                dst.write(
+                    patch,
+                    window=(
+                        (row * PATCH_SIZE, (row + 1) * PATCH_SIZE),
+                        (col * PATCH_SIZE, (col + 1) * PATCH_SIZE),
+                    ),
+                )
+    return len(windows)
+
+
+def run_config(config, args, sample_path, work_dir):
+    """Infer the sample raster with use.py in a fresh process"""
+    stats_path = os.path.join(work_dir, "stats.json")
+    command = [
+        sys.executable,
+        os.path.join(SCRIPTS_DIR, "use.py"),
+        "--no-profile",
+        "--no-cache",
+        "--input",
+        sample_path,
+        "--output",
+        os.path.join(work_dir, "truth.tif"),
+        "--checkpoint",
+        args.checkpoint,
+        "--backend",
+        args.backend,
+        "--precision",
+        args.precision,
+        "--stats-json",
+        stats_path,
+    ]
+    for setting, value in config.items():
+        command += [f"--{setting.replace('_', '-')}", str(value)]
+
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        return None
+
+    with open(stats_path, "r") as f:
+        stats = json.load(f)
+    # The parent keeps a copy of the model next to every worker's
+    peak_mb = stats["peak_rss_mb"] or 0
+    if config["workers"] > 1:
+        peak_mb += config["workers"] * (stats["peak_child_rss_mb"] or 0)
+    return {
+        "patches_per_s": stats["patches"] / stats["inference_s"],
+        "peak_mb": peak_mb,
+    }
+
+
+def sweep(name, values, best, args, sample_path, work_dir, budget_mb, results):
+    """Try each value of one setting with the others fixed.
+
+    Returns the fastest configuration that fits the budget out of every run
+    so far, so a sweep that only finds slower values keeps the previous best.
+    """
+    best_config, best_rate = None, 0.0
+    for result in results:
+        if result["fits"] and result["patches_per_s"] > best_rate:
+            best_config = {key: result[key] for key in TUNED_SETTINGS}
+            best_rate = result["patches_per_s"]
+
+    for value in values:
+        config = dict(best, **{name: value})
+        if name == "workers" and value > 1:
+            # Split the cores between workers, as use.py does by default
+            config["intra_op_threads"] = max(1, (os.cpu_count() or 1) // value)
+            config["inter_op_threads"] = 1
+
+        # The best value of the last sweep comes round again in this one
+        if any(all(r[key] == config[key] for key in TUNED_SETTINGS) for r in results):
+            continue
+
+        started = time.perf_counter()
+        result = run_config(config, args, sample_path, work_dir)
+        if result is None:
+            print(f"⚠ {config} failed")
+            continue
+        fits = budget_mb is None or result["peak_mb"] <= budget_mb
+        print(
+            f"   {config}: {result['patches_per_s']:.2f} patches/s, "
+            f"peak {result['peak_mb']:.0f} MB"
+            f"{'' if fits else ' (over budget)'} "
+            f"[{time.perf_counter() - started:.0f}s]"
+        )
+        results.append(dict(config, **result, fits=fits))
+        if fits and result["patches_per_s"] > best_rate:
+            best_config, best_rate = config, result["patches_per_s"]
+
+    return best_config or best
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Find the fastest batch size, threads and workers for this machine"
+    )
+    parser.add_argument("--input", default=RAW_PATH)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="fp32")
+    parser.add_argument("--patches", type=int, default=SAMPLE_PATCHES)
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=float,
+        help=f"peak memory allowed, {MEMORY_FRACTION:.0%} of physical memory "
+        "by default",
+    )
+    parser.add_argument("--profile", default=profile_path())
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cpu_count = os.cpu_count() or 1
+    budget_mb = args.memory_budget_mb
+    if budget_mb is None and total_memory_mb() is not None:
+        budget_mb = MEMORY_FRACTION * total_memory_mb()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        sample_path = os.path.join(work_dir, "sample.tif")
+        patches = write_sample_raster(args.input, sample_path, args.patches)
+        print(f"🗂 Tuning on {patches} patches from {args.input}")
+        if budget_mb is not None:
+            print(f"Memory budget: {budget_mb:.0f} MB")
+
+        # One setting at a time, each sweep starts from the best so far
+        best = {
+            "batch_size": 8,
+            "intra_op_threads": cpu_count,
+            "inter_op_threads": 1,
+            "workers": 1,
+        }
+        sweeps = [
+            ("batch_size", BATCH_SIZES),
+            ("intra_op_threads", thread_counts(cpu_count)),
+            ("inter_op_threads", INTER_OP_THREADS),
+            ("workers", worker_counts(cpu_count)),
+        ]
+        for name, values in sweeps:
+            print(f"🚀 Sweeping {name} over {values}")
+            best = sweep(
+                name, values, best, args, sample_path, work_dir, budget_mb, results
+            )
+
+    best_result = next(
+        (
+            result
+            for result in reversed(results)
+            if result["fits"]
+            and all(result[key] == best[key] for key in TUNED_SETTINGS)
+        ),
+        None,
+    )
+    if best_result is None:
+        print("❌ No configuration ran within the memory budget")
+        sys.exit(1)
+
+    # Keep other backends' settings already tuned on this machine
+    profile = {"configs": {}}
+    if os.path.exists(args.profile):
+        with open(args.profile, "r") as f:
+            profile = json.load(f)
+    profile["machine"] = {
+        "node": platform.node(),
+        "cpu_count": cpu_count,
+        "memory_mb": total_memory_mb(),
+        "torch": torch.__version__,
+        "cuda": torch.cuda.get_device_name() if torch.cuda.is_available() else None,
+    }
+    profile["configs"][f"{args.backend}/{args.precision}"] = dict(
+        best,
+        patches_per_s=best_result["patches_per_s"],
+        peak_mb=best_result["peak_mb"],
+        tuned=time.strftime("%Y-%m-%d %H:%M:%S"),
+        sweep=results,
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.profile)), exist_ok=True)
+    with open(args.profile, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"Best: {best} at {best_result['patches_per_s']:.2f} patches/s")
+    print(f"✅ Profile saved as {args.profile}, use.py will pick it up")
+
+
+if __name__ == "__main__":
+    main()
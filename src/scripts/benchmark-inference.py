@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import tempfile
+import numpy as np
+import rasterio
+import torch
+from rasterio.transform import from_origin
+from use import build_unet
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_PATH = "../../assets/temp/benchmark.json"
+
+# Settings that must match for a compiled and an eager run to be compared
+CONFIG_KEYS = ["backend", "precision", "batch_size", "threads", "workers"]
+
+# Written in bands so generating a large raster doesn't need it all in memory
+GENERATE_ROWS = 1024
+
+
+def make_raster(path, height, width, dtype, nodata_fraction, seed=0):
+    """Random 4-band reflectance raster, the right nodata_fraction is all zeros.
+
+    Nodata sits on the right so the first patch in row-major order is real
+    data and time to first patch includes a forward pass.
+    """
+    rng = np.random.default_rng(seed)
+    nodata_cols = int(width * nodata_fraction)
+    profile = {
+        "driver": "GTiff",
+        "height": height,
+        "width": width,
+        "count": 4,
+        "dtype": dtype,
+        "nodata": 0,
+        "crs": "EPSG:32651",
+        "transform": from_origin(500000, 1900000, 10, 10),
+        "BIGTIFF": "IF_SAFER",
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        for top in range(0, height, GENERATE_ROWS):
+            rows = min(GENERATE_ROWS, height - top)
+            data = rng.integers(1, 10000, size=(4, rows, width)).astype(dtype)
+            data[:, :, width - nodata_cols :] = 0
+            dst.write(data, window=((top, top + rows), (0, width)))
+
+
+def make_checkpoint(path, seed=0):
+    """Randomly initialised U-Net saved like a training checkpoint"""
+    torch.manual_seed(seed)
+    model = build_unet()
+    torch.save(
+        {"epoch": 0, "model_state_dict": model.state_dict(), "val_loss": None}, path
+    )
+
+
+def run_config(config, raster_path, checkpoint_path, onnx_path, int8_path, work_dir):
+    """Run use.py once in a fresh process and derive throughput numbers"""
+    stats_path = os.path.join(work_dir, "stats.json")
+    options = {
+        "--input": raster_path,
+        "--output": os.path.join(work_dir, "truth.tif"),
+        "--checkpoint": checkpoint_path,
+        "--onnx-path": onnx_path,
+        "--int8-path": int8_path,
+        "--stats-json": stats_path,
+        "--backend": config["backend"],
+        "--precision": config["precision"],
+        "--batch-size": config["batch_size"],
+        "--intra-op-threads": config["threads"],
+        "--workers": config["workers"],
+    }
+    # Cached predictions and tuned settings would skew the configs under test
+    command = [
+        sys.executable,
+        os.path.join(SCRIPTS_DIR, "use.py"),
+        "--no-cache",
+        "--no-profile",
+    ]
+    for option, value in options.items():
+        command += [option, str(value)]
+    if config["mode"] == "compile":
+        compile_dir = os.path.join(work_dir, "compile")
+        command += ["--compile", "--compile-cache-dir", compile_dir]
+
+    started = time.time()
+    process = subprocess.run(command, capture_output=True, text=True)
+    wall = time.time() - started
+    if process.returncode != 0:
+        return dict(config, error=process.stdout[-2000:] + process.stderr[-2000:])
+
+    with open(stats_path, "r") as f:
+        stats = json.load(f)
+    # Nodata patches are skipped without a forward pass, they don't count
+    inferred = stats["patches"] - stats["skipped"]
+    return dict(
+        config,
+        patches=stats["patches"],
+        skipped=stats["skipped"],
+        patches_per_s=inferred / stats["inference_s"],
+        mp_per_s=stats["pixels"] / stats["inference_s"] / 1e6,
+        peak_rss_mb=stats["peak_rss_mb"],
+        peak_child_rss_mb=stats["peak_child_rss_mb"],
+        time_to_first_patch_s=stats["first_write_time"] - started,
+        inference_s=stats["inference_s"],
+        compile_s=stats.get("compile_s"),
+        wall_s=wall,
+    )
+
+
+def compile_summary(results):
+    """Compile cost against the steady-state gain over the matching eager run.
+
+    break_even_patches is how many patches the compiled model has to infer
+    before a cold compile has paid for itself.
+    """
+    summary = []
+    for result in results:
+        if result.get("mode") != "compile" or "error" in result:
+            continue
+        eager = next(
+            (
+                other
+                for other in results
+                if other.get("mode") == "eager"
+                and "error" not in other
+                and all(
+                    other[key] == result[key]
+                    for key in CONFIG_KEYS
+                )
+            ),
+            None,
+        )
+        if eager is None:
+            continue
+        saved_per_patch = 1 / eager["patches_per_s"] - 1 / result["patches_per_s"]
+        summary.append(
+            {
+                "batch_size": result["batch_size"],
+                "precision": result["precision"],
+                "threads": result["threads"],
+                "cold_compile_s": result["cold_compile_s"],
+                "cached_compile_s": result["compile_s"],
+                "speedup": result["patches_per_s"] / eager["patches_per_s"],
+                "break_even_patches": (
+                    result["cold_compile_s"] / saved_per_patch
+                    if saved_per_patch > 0
+                    else None
+                ),
+            }
+        )
+    return summary
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def str_list(value):
+    return [v.strip() for v in value.split(",")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark use.py on a synthetic raster with random weights"
+    )
+    parser.add_argument("--height", type=int, default=2048)
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--dtype", choices=["uint16", "float32"], default="uint16")
+    parser.add_argument("--nodata-fraction", type=float, default=0.3)
+    parser.add_argument("--batch-sizes", type=int_list, default=[1, 8])
+    parser.add_argument("--threads", type=int_list, default=[0])
+    parser.add_argument("--precisions", type=str_list, default=["fp32"])
+    parser.add_argument("--backends", type=str_list, default=["torch"])
+    parser.add_argument("--workers", type=int_list, default=[1])
+    parser.add_argument(
+        "--modes",
+        type=str_list,
+        default=["eager"],
+        help="eager and/or compile (torch.compile, torch backend only)",
+    )
+    parser.add_argument("--output", default=RESULTS_PATH)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        raster_path = os.path.join(work_dir, "raw.tif")
+        checkpoint_path = os.path.join(work_dir, "model.pth")
+        onnx_path = os.path.join(work_dir, "model.onnx")
+        int8_path = os.path.join(work_dir, "model.int8.onnx")
+
+        print(f"🗂 Generating {args.width} x {args.height} {args.dtype} raster...")
+        make_raster(
+            raster_path, args.height, args.width, args.dtype, args.nodata_fraction
+        )
+        make_checkpoint(checkpoint_path)
+        if "onnx" in args.backends or "int8" in args.backends:
+            subprocess.run(
+                [
+                    sys.executable,
+                    os.path.join(SCRIPTS_DIR, "export-onnx.py"),
+                    checkpoint_path,
+                    onnx_path,
+                ],
+                check=True,
+                capture_output=True,
+            )
+        if "int8" in args.backends:
+            # Quantized from the same random weights, calibrated on this raster
+            from quantize import quantize
+
+            print("🚀 Quantizing the synthetic model...")
+            quantize(raster_path, onnx_path, int8_path, truth_path=None)
+
+        results = []
+        grid = itertools.product(
+            args.modes,
+            args.backends,
+            args.precisions,
+            args.batch_sizes,
+            args.threads,
+            args.workers,
+        )
+        for mode, backend, precision, batch_size, threads, workers in grid:
+            # Reduced precision and compiling only exist for the torch backend
+            if backend != "torch" and (precision != "fp32" or mode != "eager"):
+                continue
+            if mode == "compile" and workers > 1:
+                continue
+            config = {
+                "mode": mode,
+                "backend": backend,
+                "precision": precision,
+                "batch_size": batch_size,
+                "threads": threads,
+                "workers": workers,
+            }
+            print(f"🚀 {config}")
+            result = run_config(
+                config, raster_path, checkpoint_path, onnx_path, int8_path, work_dir
+            )
+            if mode == "compile" and "error" not in result:
+                # Measure again with the compile cache the first run filled
+                cold_compile_s = result["compile_s"]
+                result = run_config(
+                    config, raster_path, checkpoint_path, onnx_path, int8_path, work_dir
+                )
+                result["cold_compile_s"] = cold_compile_s
+            if "error" in result:
+                print(f"⚠ Failed: {result['error']}")
+            else:
+                print(
+                    f"   {result['patches_per_s']:.1f} patches/s, "
+                    f"{result['mp_per_s']:.2f} MP/s, "
+                    f"first patch after {result['time_to_first_patch_s']:.1f}s"
+                )
+            results.append(result)
+
+    report = {
+        "raster": {
+            "height": args.height,
+            "width": args.width,
+            "dtype": args.dtype,
+            "nodata_fraction": args.nodata_fraction,
+        },
+        "torch": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "results": results,
+        "compile": compile_summary(results),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"✅ Results saved as {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import collections
+import threading
+import numpy as np
+from rasterio.windows import Window
+
+# -----------------------
+# Configuration
+# -----------------------
+# Decoded input blocks kept by use.py, which counts block reads. It takes its
+# share out of use.py's MEMORY_BUDGET_MB, so GDAL is left with the rest.
+BLOCK_CACHE_MB = 384
+PATCH_ORDERS = ["hilbert", "row-major"]
+
+
+def hilbert_index(n, x, y):
+    """Distance of cell (x, y) along the Hilbert curve over an n x n grid.
+
+    n must be a power of two, consecutive distances are neighbouring cells.
+    """
+    d = 0
+    s = n // 2
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x, y = n - 1 - x, n - 1 - y
+            x, y = y, x
+        s //= 2
+    return d
+
+
+def schedule_windows(windows, src, order, patch_size):
+    """Order windows so the file blocks they need are read close together.
+
+    Windows are grouped into cells of the file's block size (or the patch
+    size, whichever is larger). Cells are visited along a Hilbert curve and
+    the windows inside one cell in row-major order, so every patch of a
+    block comes up before the block can fall out of the cache. Striped
+    files have one cell per column and stay in row-major order.
+    """
+    if order == "row-major":
+        return list(windows)
+
+    block_height, block_width = src.block_shapes[0]
+    cell_height = max(block_height, patch_size)
+    cell_width = max(block_width, patch_size)
+    cells = max(-(-src.height // cell_height), -(-src.width // cell_width))
+    n = 1 << max(0, (cells - 1).bit_length())
+
+    def key(window):
+        cell_x = window.col_off // cell_width
+        cell_y = window.row_off // cell_height
+        return hilbert_index(n, cell_x, cell_y), window.row_off, window.col_off
+
+    return sorted(windows, key=key)
+
+
+class BlockCache:
+    """Bounded LRU cache of decoded file blocks, shared by reader threads.
+
+    GDAL has a block cache of its own, but it can't report how often each
+    block was decompressed. Reads go through here in whole blocks, so
+    reads counts every decompression. A thread that misses a block another
+    thread is already reading waits for that read instead of repeating it.
+    """
+
+    def __init__(self, budget_mb):
+        self.budget_bytes = int(budget_mb * 1024**2)
+        self.blocks = collections.OrderedDict()
+        self.pending = {}
+        self.bytes = 0
+        self.reads = 0
+        self.lock = threading.Lock()
+
+    def block(self, src, row, col):
+        """Block (row, col) of src, reading it on a miss"""
+        key = (src.name, row, col)
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+                return block
+            pending = self.pending.get(key)
+            if pending is None:
+                self.pending[key] = threading.Event()
+
+        if pending is not None:
+            pending.wait()
+            # Read again here only if it was evicted in the meantime
+            return self.block(src, row, col)
+
+        block_height, block_width = src.block_shapes[0]
+        window = Window(
+            col * block_width,
+            row * block_height,
+            min(block_width, src.width - col * block_width),
+            min(block_height, src.height - row * block_height),
+        )
+        try:
+            block = src.read(window=window)
+            with self.lock:
+                self.reads += 1
+                self.blocks[key] = block
+                self.bytes += block.nbytes
+                while self.bytes > self.budget_bytes and len(self.blocks) > 1:
+                    _, evicted = self.blocks.popitem(last=False)
+                    self.bytes -= evicted.nbytes
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+        return block
+
+
+class CachedReader:
+    """Stands in for an open dataset, reading windows through a BlockCache"""
+
+    def __init__(self, src, cache):
+        self.src = src
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.src, name)
+
+    def read(self, window, out=None):
+        height, width = window.height, window.width
+        if out is None:
+            out = np.empty((self.src.count, height, width), self.src.dtypes[0])
+
+        block_height, block_width = self.src.block_shapes[0]
+        top, left = window.row_off, window.col_off
+        for row in range(top // block_height, (top + height - 1) // block_height + 1):
+            for col in range(
+                left // block_width, (left + width - 1) // block_width + 1
+            ):
+                block = self.cache.block(self.src, row, col)
+                # Overlap of the block and the window, in raster pixels
+                y0 = max(top, row * block_height)
+                y1 = min(top + height, row * block_height + block.shape[1])
+                x0 = max(left, col * block_width)
+                x1 = min(left + width, col * block_width + block.shape[2])
+                out[:, y0 - top : y1 - top, x0 - left : x1 - left] = block[
+                    :,
+                    y0 - row * block_height : y1 - row * block_height,
+                    x0 - col * block_width : x1 - col * block_width,
+                ]
+        return out
@@ -1,23 +1,62 @@
 import os
 import glob
+import shutil
 from osgeo import gdal
 import sys
+import tile_cache
 
 YEAR = None
-tiles_dir = "../../assets/tiles"
+tiles_dir = tile_cache.CACHE_DIR
 merged_tif = None
 target_crs = "EPSG:32651"
 clipped_tif = None
 boundary_gpkg = "../../assets/boundaries/car.gpkg"
+raw_tif = "../../assets/raw/raw.tif"
+
+# Intermediates smaller than this stay in GDAL's /vsimem/ instead of on disk
+IN_MEMORY_BUDGET_MB = 2048
+
+
+def scratch_path(filename, nbytes):
+    """Place an intermediate in memory when it fits the budget, else on disk"""
+    if nbytes <= IN_MEMORY_BUDGET_MB * 1024**2:
+        return f"/vsimem/{filename}"
+    return os.path.join(os.path.dirname(merged_tif), filename)
+
+
+def estimate_size(ds):
+    """Uncompressed size of a dataset in bytes"""
+    band = ds.GetRasterBand(1)
+    itemsize = gdal.GetDataTypeSize(band.DataType) // 8
+    return ds.RasterXSize * ds.RasterYSize * ds.RasterCount * itemsize
 
 
 def run_pipeline():
     os.makedirs(os.path.dirname(merged_tif), exist_ok=True)
 
-    tif_files = glob.glob(os.path.join(tiles_dir, "*.tif"))
+    # The cache also holds tiles from earlier runs, only mosaic this year's
+    tif_files = glob.glob(os.path.join(tiles_dir, f"{YEAR}_tile_*.tif"))
+    manifest = tile_cache.load_manifest(tiles_dir)
+
+    # ...and only those downloaded for the date range get-imagery.py last used
+    key = tile_cache.request_key(YEAR, tiles_dir)
+    if key is None:
+        print(f"⚠ No download recorded for {YEAR}, using every cached tile")
+    else:
+        stale = [
+            tif
+            for tif in tif_files
+            if manifest.get(os.path.basename(tif), {}).get("key") != key
+        ]
+        for tif in stale:
+            print(f"Skipping {os.path.basename(tif)}, not downloaded for {key}")
+        tif_files = [tif for tif in tif_files if tif not in stale]
 
     if not tif_files:
-        raise FileNotFoundError(f"No .tif files found in {tiles_dir}")
+        raise FileNotFoundError(f"No {YEAR} .tif files found in {tiles_dir}")
+
+    tile_names = [os.path.basename(tif) for tif in tif_files]
+    tile_cache.touch(manifest, tile_names)
 
     print(f"🔍 Found {len(tif_files)} tiles")
 
@@ -33,57 +72,59 @@ def run_pipeline():
         ds = None
 
     print("\n🚀 Building VRT mosaic...")
-    vrt_path = "../../assets/temp/temp.vrt"
-    gdal.BuildVRT(vrt_path, tif_files)
-    print(f"✅ VRT built: {vrt_path}")
+    # The VRT is a few KB of XML, it never needs to touch the disk
+    vrt_path = f"/vsimem/temp_{YEAR}.vrt"
+    vrt = gdal.BuildVRT(vrt_path, tif_files)
+    mosaic_bytes = estimate_size(vrt)
+    vrt = None
+    print(f"✅ VRT built: {vrt_path} ({mosaic_bytes / 1024**2:.0f} MB uncompressed)")
+
+    merged_path = scratch_path(os.path.basename(merged_tif), mosaic_bytes)
+    if merged_path.startswith("/vsimem/"):
+        print(f"🧠 Mosaic fits in {IN_MEMORY_BUDGET_MB} MB, keeping it in memory")
+    else:
+        print(f"💾 Mosaic exceeds {IN_MEMORY_BUDGET_MB} MB, spilling to disk")
 
     print("🚀 Translating VRT to GeoTIFF...")
     gdal.Translate(
-        merged_tif,
+        merged_path,
         vrt_path,
         format="GTiff",
         creationOptions=["COMPRESS=LZW", "BIGTIFF=YES"],
     )
-    print(f"✅ Merged mosaic saved as {merged_tif}")
+    print(f"✅ Merged mosaic saved as {merged_path}")
 
-    os.remove("../../assets/temp/temp.vrt")
+    gdal.Unlink(vrt_path)
 
     print(f"✅ Deleted temporary VRT")
 
     # 🔹 Clip using boundary.gpkg
     print("✂️ Clipping raster with boundary...")
+    os.makedirs(os.path.dirname(raw_tif), exist_ok=True)
     gdal.Warp(
-        f"../../assets/raw/raw.tif",
-        merged_tif,
-        cutlineDSName=boundary_gpkg,
-        cropToCutline=True,
-        dstNodata=0,  # or np.nan
-        dstSRS=target_crs,
-        creationOptions=["BIGTIFF=YES"],  # ✅ fix here
-    )
-    gdal.Warp(
-        clipped_tif,
-        merged_tif,
+        raw_tif,
+        merged_path,
         cutlineDSName=boundary_gpkg,
         cropToCutline=True,
         dstNodata=0,  # or np.nan
         dstSRS=target_crs,
         creationOptions=["BIGTIFF=YES"],  # ✅ fix here
     )
+    # Same warp as raw.tif, copying is cheaper than warping twice
+    shutil.copyfile(raw_tif, clipped_tif)
     print(f"✅ Clipped raster saved as {clipped_tif}")
 
-    os.remove(f"../../assets/temp/merged_{YEAR}.tif")
+    gdal.Unlink(merged_path)
 
     print(f"✅ Deleted merged mosaic")
-    
-    for filename in glob.glob(os.path.join(tiles_dir, "*.*")):
-        try:
-            os.remove(filename)
-            print(f"Removed: {filename}")
-        except OSError as e:
-            print(f"Error removing {filename}: {e}")
-    
-    print(f"✅ Deleted tiles")
+
+    # Keep tiles for later reruns, only evict the least recently used ones
+    removed, total = tile_cache.evict(manifest, keep=tile_names, cache_dir=tiles_dir)
+    tile_cache.save_manifest(manifest, tiles_dir)
+    for name in removed:
+        print(f"Evicted: {name}")
+
+    print(f"✅ Tile cache at {total / 1024**3:.2f} GB ({len(manifest)} tiles)")
 
 
 if __name__ == "__main__":
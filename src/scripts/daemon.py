@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -----------------------
+# Configuration
+# -----------------------
+# Only listens on localhost, see submit-job.py
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 8765
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    """POST /jobs runs one job on the resident model, GET /status describes it"""
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        with self.server.status_lock:
+            status = dict(self.server.status)
+        self.send_json(200, status)
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        received = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(job, dict):
+                raise ValueError("a job must be a JSON object of options")
+            prepared = self.server.prepare(job)
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        status = self.server.status
+        with self.server.status_lock:
+            status["queued"] += 1
+        # Requests are handled on their own threads, jobs still run one at a time
+        with self.server.job_lock:
+            with self.server.status_lock:
+                status["queued"] -= 1
+                status["busy"] = True
+            print(f"🚀 Job {status['jobs'] + 1}: {json.dumps(job)}")
+            try:
+                result = self.server.run(prepared)
+            except Exception as e:
+                print(f"❌ Job failed: {e}")
+                self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+                return
+            finally:
+                with self.server.status_lock:
+                    status["busy"] = False
+
+            with self.server.status_lock:
+                status["jobs"] += 1
+        elapsed = time.perf_counter() - received
+        inference_s = result["stats"]["inference_s"]
+        result["timings"] = {
+            "setup_s": elapsed - inference_s,
+            "inference_s": inference_s,
+            "total_s": elapsed,
+        }
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+
+def serve(prepare, run, status, port=DAEMON_PORT):
+    """Run jobs posted to localhost until interrupted.
+
+    prepare turns a posted job into arguments for run, raising ValueError
+    for a bad job. run does the work and returns the reply, whose stats
+    must hold inference_s. Jobs run one at a time, in the order they
+    arrive. Each request gets its own thread, so /status still answers
+    while a job is running.
+    """
+    server = ThreadingHTTPServer((DAEMON_HOST, port), JobHandler)
+    server.prepare = prepare
+    server.run = run
+    server.job_lock = threading.Lock()
+    server.status_lock = threading.Lock()
+    # Kept as the caller's dict, so run can update what /status reports
+    server.status = status
+    status.update(
+        pid=os.getpid(),
+        started=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        jobs=0,
+        busy=False,
+        queued=0,
+    )
+    print(f"✅ Serving on http://{DAEMON_HOST}:{port}, POST jobs to /jobs")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,60 @@
+import os
+import sys
+import numpy as np
+import torch
+import onnx
+import onnxruntime as ort
+from use import load_model, CHECKPOINT_PATH, ONNX_PATH, PATCH_SIZE
+
+OPSET_VERSION = 18
+
+
+def export(checkpoint_path, onnx_path):
+    device = torch.device("cpu")
+    model, checkpoint = load_model(checkpoint_path, device)
+
+    # The memory efficient swish is a custom autograd function ONNX can't trace
+    if hasattr(model.encoder, "set_swish"):
+        model.encoder.set_swish(memory_efficient=False)
+
+    dummy = torch.rand(1, 4, PATCH_SIZE, PATCH_SIZE)
+    print(f"🚀 Exporting {checkpoint_path} to ONNX...")
+    torch.onnx.export(
+        model,
+        dummy,
+        onnx_path,
+        input_names=["image"],
+        output_names=["logits"],
+        dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=OPSET_VERSION,
+    )
+
+    # Keep the checkpoint metadata so use.py can still tag its output
+    proto = onnx.load(onnx_path)
+    for key in ["epoch", "val_loss"]:
+        entry = proto.metadata_props.add()
+        entry.key = key
+        entry.value = str(checkpoint.get(key, "unknown"))
+    onnx.checker.check_model(proto)
+    onnx.save(proto, onnx_path, save_as_external_data=False)
+
+    # The exporter's external data file is inlined now, a stale copy would
+    # only end up in use.py's cache key
+    data_path = onnx_path + ".data"
+    if os.path.exists(data_path):
+        os.remove(data_path)
+    print(f"✅ ONNX model saved as {onnx_path}")
+
+    # Sanity check against eager PyTorch with a batch size other than the trace
+    batch = torch.rand(2, 4, PATCH_SIZE, PATCH_SIZE)
+    with torch.no_grad():
+        expected = model(batch).numpy()
+    session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    actual = session.run(None, {"image": batch.numpy()})[0]
+    print(f"Max abs difference vs PyTorch: {np.abs(expected - actual).max():.2e}")
+
+
+if __name__ == "__main__":
+    checkpoint_path = sys.argv[1] if len(sys.argv) > 1 else CHECKPOINT_PATH
+    onnx_path = sys.argv[2] if len(sys.argv) > 2 else ONNX_PATH
+    export(checkpoint_path, onnx_path)
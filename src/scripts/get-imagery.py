@@ -1,8 +1,12 @@
+import os
 import sys
+import json
+import hashlib
 import ee
 import geemap
 from aoi import get_aoi_bbox
 from tqdm import tqdm
+import tile_cache
 
 ee.Authenticate()
 
@@ -17,6 +21,10 @@ CLD_PRB_THRESH = 50
 NIR_DRK_THRESH = 0.15
 CLD_PRJ_DIST = 1
 BUFFER = 50
+BANDS = ["B4", "B3", "B2", "B8"]
+EXPORT_SCALE = 10
+EXPORT_CRS = "EPSG:32651"
+GRID_KM = 10
 
 
 def add_cloud_bands(img):
@@ -104,6 +112,30 @@ def make_grid(aoi, dx_km=10, dy_km=10):
     return geemap.fishnet(aoi, h_interval=dx, v_interval=dy)
 
 
+def export_key():
+    """Cache key of a tile, changes with the dates or any export setting.
+
+    A fix to the cloud masking or a new grid must not reuse old tiles, so
+    everything that shapes a tile goes into a short hash next to the dates.
+    """
+    settings = {
+        "aoi": list(get_aoi_bbox()),
+        "cloud_filter": CLOUD_FILTER,
+        "cld_prb_thresh": CLD_PRB_THRESH,
+        "nir_drk_thresh": NIR_DRK_THRESH,
+        "cld_prj_dist": CLD_PRJ_DIST,
+        "buffer": BUFFER,
+        "bands": BANDS,
+        "scale": EXPORT_SCALE,
+        "crs": EXPORT_CRS,
+        "grid_km": GRID_KM,
+    }
+    digest = hashlib.blake2b(
+        json.dumps(settings, sort_keys=True).encode(), digest_size=8
+    ).hexdigest()
+    return f"{START_DATE}/{END_DATE}/{digest}"
+
+
 def run_pipeline():
     s2_sr_col = (
         ee.ImageCollection("COPERNICUS/S2_SR")
@@ -132,27 +164,54 @@ def run_pipeline():
 
     masked = imagery.map(add_cld_shdw_mask).map(apply_cld_shdw_mask)
     cloudless = masked.median()
-    true_color = cloudless.select(["B4", "B3", "B2", "B8"])
+    true_color = cloudless.select(BANDS)
 
-    grid = make_grid(AOI, dx_km=10, dy_km=10)
+    grid = make_grid(AOI, dx_km=GRID_KM, dy_km=GRID_KM)
     features = grid.toList(grid.size())
     n = grid.size().getInfo()
 
+    # Tiles are only reused if they were exported for the same date range
+    cache_key = export_key()
+    manifest = tile_cache.load_manifest()
+    tile_cache.save_request(YEAR, cache_key)
+    cached = 0
+
     # Local export instead of Google Drive
     for i in tqdm(range(n), desc="Downloading Tiles"):
+        name = f"{YEAR}_tile_{i}.tif"
+        if tile_cache.lookup(manifest, name, cache_key):
+            cached += 1
+            continue
+
+        # A tile from another date range must not survive a skip or failed export
+        tile_cache.remove(manifest, name)
+        tile_cache.save_manifest(manifest)
+
         tile = ee.Feature(features.get(i)).geometry()
         count = masked.filterBounds(tile).size().getInfo()
         if count == 0:
             print(f"⚠ Tile {i} has no images, skipping.")
             continue
-        out_tif = f"../../assets/tiles/{YEAR}_tile_{i}.tif"
+        out_tif = os.path.join(tile_cache.CACHE_DIR, name)
         geemap.ee_export_image(
             true_color.clip(tile),
             filename=out_tif,
-            scale=10,
-            crs="EPSG:32651",
+            scale=EXPORT_SCALE,
+            crs=EXPORT_CRS,
             region=tile,
         )
+        # ee_export_image prints export errors instead of raising them
+        if os.path.exists(out_tif) and os.path.getsize(out_tif) > 0:
+            tile_cache.add(manifest, name, cache_key)
+            tile_cache.save_manifest(manifest)
+        else:
+            print(f"⚠ Tile {i} failed to export, skipping.")
+
+    print(f"♻ Reused {cached} cached tiles")
+
+    current = [f"{YEAR}_tile_{i}.tif" for i in range(n)]
+    tile_cache.evict(manifest, keep=current)
+    tile_cache.save_manifest(manifest)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import numpy as np
+
+# -----------------------
+# Configuration
+# -----------------------
+CACHE_PATH = "../../assets/cache/patches.sqlite"
+CACHE_BUDGET_MB = 2048
+
+# Bump when use.py changes what it predicts for the same patch and weights
+CACHE_VERSION = 1
+
+HASH_CHUNK_BYTES = 16 * 1024**2
+
+
+def file_digest(path):
+    """blake2b hex digest of a file, read in chunks"""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PatchCache:
+    """Compressed uint8 predictions keyed by patch content, weights and settings.
+
+    Entries live in one SQLite file so worker processes can share it. Keys
+    are content hashes of the raw patch, salted with a namespace that covers
+    the model weights and every setting that changes the prediction, so a
+    patch that moves in the raster still hits and a new model never does.
+    """
+
+    def __init__(self, path=CACHE_PATH, budget_mb=CACHE_BUDGET_MB):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.budget_bytes = int(budget_mb * 1024**2)
+        self.namespace = b""
+        self.touched = []
+
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS patches ("
+            "key BLOB PRIMARY KEY, data BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS patches_by_access ON patches (last_access)"
+        )
+        # Weight files are hashed once per (path, mtime, size)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, mtime REAL, size INTEGER, digest TEXT)"
+        )
+        self.db.commit()
+
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        mtime, size = os.path.getmtime(path), os.path.getsize(path)
+        row = self.db.execute(
+            "SELECT digest FROM files WHERE path = ? AND mtime = ? AND size = ?",
+            (path, mtime, size),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        digest = file_digest(path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (path, mtime, size, digest),
+        )
+        self.db.commit()
+        return digest
+
+    def set_namespace(self, weight_paths, settings):
+        """Salt every key with the weights and the inference settings"""
+        namespace = hashlib.blake2b(digest_size=16)
+        namespace.update(str(CACHE_VERSION).encode())
+        for path in weight_paths:
+            namespace.update(self.file_digest(path).encode())
+        namespace.update(json.dumps(settings, sort_keys=True).encode())
+        self.namespace = namespace.digest()
+
+    def key(self, raw):
+        """Key of one raw (bands, height, width) patch, safe to call from threads"""
+        key = hashlib.blake2b(self.namespace, digest_size=16)
+        key.update(f"{raw.dtype.str}{raw.shape}".encode())
+        key.update(np.ascontiguousarray(raw).data)
+        return key.digest()
+
+    def get(self, key, shape):
+        """(pred, confidence or None) for a (height, width) window, None on a miss"""
+        row = self.db.execute(
+            "SELECT data FROM patches WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        self.touched.append(key)
+        data = np.frombuffer(zlib.decompress(row[0]), np.uint8)
+        pixels = shape[0] * shape[1]
+        pred = data[:pixels].reshape(shape)
+        confidence = data[pixels:].reshape(shape) if len(data) > pixels else None
+        return pred, confidence
+
+    def put(self, key, pred, confidence=None):
+        data = pred.tobytes()
+        if confidence is not None:
+            data += confidence.tobytes()
+        data = zlib.compress(data)
+        self.db.execute(
+            "INSERT OR REPLACE INTO patches VALUES (?, ?, ?, ?)",
+            (key, data, len(data), time.time()),
+        )
+
+    def flush(self):
+        """Commit new entries and the access times of hits"""
+        now = time.time()
+        self.db.executemany(
+            "UPDATE patches SET last_access = ? WHERE key = ?",
+            [(now, key) for key in self.touched],
+        )
+        self.touched = []
+        self.db.commit()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits its budget"""
+        self.flush()
+        total = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM patches"
+        ).fetchone()[0]
+        removed = 0
+        if total > self.budget_bytes:
+            rows = self.db.execute(
+                "SELECT key, size FROM patches ORDER BY last_access"
+            ).fetchall()
+            stale = []
+            for key, size in rows:
+                if total <= self.budget_bytes:
+                    break
+                stale.append((key,))
+                total -= size
+            self.db.executemany("DELETE FROM patches WHERE key = ?", stale)
+            self.db.commit()
+            removed = len(stale)
+        return removed, total
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,235 @@
+import os
+import glob
+import json
+import numpy as np
+import rasterio
+import torch
+from rasterio.windows import Window
+from torch.utils.data import Dataset
+
+# -----------------------
+# Configuration
+# -----------------------
+DATASET_DIR = "../../assets/dataset"
+INDEX_NAME = "index.json"
+PATCH_SIZE = 256
+IGNORE_INDEX = 255
+
+# Patches per shard, 128 MB of uint16 image data at 256 x 256
+SHARD_PATCHES = 256
+
+# uint16 keeps the clipped reflectance exactly, float16 stores it normalized
+PATCH_DTYPES = ["uint16", "float16"]
+REFLECTANCE_MAX = 10000
+
+# Same proportions as the old train_test_split(0.3) then (0.5)
+SPLITS = {"train": 0.7, "val": 0.15, "test": 0.15}
+SPLIT_SEED = 42
+
+# Original class values and mapping
+original_classes = [0, 1, 2, 5, 7, 8, 10, 11]
+class_mapping = {old: new for new, old in enumerate(original_classes)}
+max_class = max(original_classes)
+
+# Create lookup table for remapping
+lookup_table = np.full(max_class + 2, IGNORE_INDEX, dtype=np.uint8)
+for old, new in class_mapping.items():
+    lookup_table[old] = new
+
+
+def remap_classes(mask_array):
+    """Remap classes using vectorized operations"""
+    clipped = np.clip(mask_array, 0, max_class + 1)
+    return lookup_table[clipped]
+
+
+def index_path(dataset_dir=DATASET_DIR):
+    return os.path.join(dataset_dir, INDEX_NAME)
+
+
+def source_info(path):
+    """Path, mtime and size of a source raster, to tell when it has changed"""
+    return {
+        "path": os.path.abspath(path),
+        "mtime": os.path.getmtime(path),
+        "size": os.path.getsize(path),
+    }
+
+
+def read_band(src, top, height, width, patch_size, fill=None):
+    """Rows top:top+height of the first width columns padded to whole patches.
+
+    The last band of a raster is read together with the rows above it so the
+    bottom padding mirrors real rows, as np.pad of the whole raster did.
+    """
+    context = min(top, patch_size) if height < patch_size else 0
+    band = src.read(window=Window(0, top - context, width, height + context))
+    pad_h = patch_size - height if height < patch_size else 0
+    pad_w = -width % patch_size
+    pad = ((0, 0), (0, pad_h), (0, pad_w))
+    if fill is None:
+        band = np.pad(band, pad, mode="reflect")
+    else:
+        band = np.pad(band, pad, mode="constant", constant_values=fill)
+    return band[:, context:]
+
+
+def normalize_band(band, dtype):
+    """Clip reflectance to 0..10000, NaN becomes IGNORE_INDEX like before"""
+    band = band.astype(np.float32)
+    band = np.nan_to_num(band, nan=IGNORE_INDEX)
+    band = np.clip(band, 0, REFLECTANCE_MAX)
+    if dtype == "float16":
+        return (band / REFLECTANCE_MAX).astype(np.float16)
+    return band.astype(np.uint16)
+
+
+def write_dataset(
+    image_path,
+    mask_path,
+    dataset_dir=DATASET_DIR,
+    dtype="uint16",
+    patch_size=PATCH_SIZE,
+    shard_patches=SHARD_PATCHES,
+):
+    """Cut the raster and truth into patches stored as .npy shards.
+
+    Reads one row of patches at a time, so memory is bounded by the raster
+    width and the shard size rather than the region. Patches whose mask is
+    all IGNORE_INDEX are dropped here instead of at training time. The index
+    is written last, a run that stops halfway leaves no usable dataset.
+    """
+    # Shards of an earlier run go first, the index before anything else
+    os.makedirs(dataset_dir, exist_ok=True)
+    if os.path.exists(index_path(dataset_dir)):
+        os.remove(index_path(dataset_dir))
+    for stale in glob.glob(os.path.join(dataset_dir, "*_[0-9]*.npy")):
+        os.remove(stale)
+
+    shards = []
+    patches = []
+    images = np.empty((shard_patches, 4, patch_size, patch_size), dtype=dtype)
+    masks = np.empty((shard_patches, patch_size, patch_size), dtype=np.uint8)
+    count = 0
+
+    def flush():
+        shard = len(shards)
+        image_name = f"images_{shard:04d}.npy"
+        mask_name = f"masks_{shard:04d}.npy"
+        np.save(os.path.join(dataset_dir, image_name), images[:count])
+        np.save(os.path.join(dataset_dir, mask_name), masks[:count])
+        shards.append({"images": image_name, "masks": mask_name, "patches": count})
+
+    with rasterio.open(image_path) as src, rasterio.open(mask_path) as truth:
+        assert src.count == 4, f"Expected 4 bands, got {src.count}"
+        if (src.height, src.width) != (truth.height, truth.width):
+            print(
+                f"⚠ Image is {src.width} x {src.height} but the mask is "
+                f"{truth.width} x {truth.height}, using the overlap"
+            )
+        height = min(src.height, truth.height)
+        width = min(src.width, truth.width)
+        columns = -(-width // patch_size)
+
+        for top in range(0, height, patch_size):
+            rows = min(patch_size, height - top)
+            image_band = normalize_band(
+                read_band(src, top, rows, width, patch_size), dtype
+            )
+            mask_band = read_band(truth, top, rows, width, patch_size, max_class + 1)
+            mask_band = np.nan_to_num(mask_band[0], nan=IGNORE_INDEX)
+            mask_band = remap_classes(mask_band.astype(np.int64))
+            for col in range(columns):
+                left = col * patch_size
+                mask = mask_band[:, left : left + patch_size]
+                if np.all(mask == IGNORE_INDEX):
+                    continue
+                images[count] = image_band[:, :, left : left + patch_size]
+                masks[count] = mask
+                patches.append([len(shards), count, top // patch_size, col])
+                count += 1
+                if count == shard_patches:
+                    flush()
+                    count = 0
+            print(f"Row {top // patch_size + 1}/{-(-height // patch_size)}")
+    if count:
+        flush()
+
+    # Split by patch, fixed seed so every run trains on the same split
+    order = np.random.default_rng(SPLIT_SEED).permutation(len(patches))
+    splits = {}
+    start = 0
+    for name, fraction in SPLITS.items():
+        end = len(order) if name == "test" else start + round(fraction * len(order))
+        splits[name] = sorted(order[start:end].tolist())
+        start = end
+
+    index = {
+        "sources": {
+            "image": source_info(image_path),
+            "mask": source_info(mask_path),
+        },
+        "patch_size": patch_size,
+        "dtype": dtype,
+        "shards": shards,
+        "patches": patches,
+        "splits": splits,
+    }
+    with open(index_path(dataset_dir), "w") as f:
+        json.dump(index, f)
+    return index
+
+
+def load_index(dataset_dir=DATASET_DIR):
+    with open(index_path(dataset_dir), "r") as f:
+        return json.load(f)
+
+
+def is_current(image_path, mask_path, dataset_dir=DATASET_DIR, patch_size=PATCH_SIZE):
+    """True when dataset_dir holds patches of these rasters as they are now"""
+    if not os.path.exists(index_path(dataset_dir)):
+        return False
+    index = load_index(dataset_dir)
+    sources = {"image": source_info(image_path), "mask": source_info(mask_path)}
+    return index.get("patch_size") == patch_size and index.get("sources") == sources
+
+
+class PatchDataset(Dataset):
+    """One split of a write_dataset directory, read lazily from memory maps.
+
+    Shards are opened on first use in each process, so DataLoader workers
+    map the files themselves and only the pages of patches actually read
+    are held in memory.
+    """
+
+    def __init__(self, dataset_dir=DATASET_DIR, split="train"):
+        index = load_index(dataset_dir)
+        self.dataset_dir = dataset_dir
+        self.dtype = index["dtype"]
+        self.shards = index["shards"]
+        self.patches = [index["patches"][i][:2] for i in index["splits"][split]]
+        self.images = None
+        self.masks = None
+
+    def open(self):
+        self.images = [
+            np.load(os.path.join(self.dataset_dir, shard["images"]), mmap_mode="r")
+            for shard in self.shards
+        ]
+        self.masks = [
+            np.load(os.path.join(self.dataset_dir, shard["masks"]), mmap_mode="r")
+            for shard in self.shards
+        ]
+
+    def __len__(self):
+        return len(self.patches)
+
+    def __getitem__(self, idx):
+        if self.images is None:
+            self.open()
+        shard, offset = self.patches[idx]
+        image = torch.from_numpy(self.images[shard][offset].astype(np.float32))
+        if self.dtype == "uint16":
+            image /= REFLECTANCE_MAX
+        mask = torch.from_numpy(self.masks[shard][offset].astype(np.int64))
+        return image, mask
@@ -0,0 +1,50 @@
+import argparse
+from patch_dataset import (
+    DATASET_DIR,
+    PATCH_SIZE,
+    PATCH_DTYPES,
+    SHARD_PATCHES,
+    write_dataset,
+)
+
+# Configuration
+RAW_PATH = "../../assets/raw/raw.tif"
+TRUTH_PATH = "../../assets/truth/truth.tif"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Write the training patches to memory-mapped .npy shards"
+    )
+    parser.add_argument("--input", default=RAW_PATH)
+    parser.add_argument("--truth", default=TRUTH_PATH)
+    parser.add_argument("--output", default=DATASET_DIR)
+    parser.add_argument(
+        "--dtype",
+        choices=PATCH_DTYPES,
+        default="uint16",
+        help="uint16 keeps reflectance exactly, float16 stores it normalized",
+    )
+    parser.add_argument("--patch-size", type=int, default=PATCH_SIZE)
+    parser.add_argument("--shard-patches", type=int, default=SHARD_PATCHES)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(f"🗂 Cutting {args.input} and {args.truth} into patches...")
+    index = write_dataset(
+        args.input,
+        args.truth,
+        args.output,
+        dtype=args.dtype,
+        patch_size=args.patch_size,
+        shard_patches=args.shard_patches,
+    )
+    sizes = ", ".join(f"{len(v)} {k}" for k, v in index["splits"].items())
+    print(f"Kept {len(index['patches'])} patches with labels ({sizes})")
+    print(f"✅ Dataset saved in {args.output} ({len(index['shards'])} shards)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import sys
+import os
+import numpy as np
+import rasterio
+import torch
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+from use import (
+    OnnxModel,
+    read_patch,
+    sample_windows,
+    timed_predictions,
+    per_class_iou,
+    RAW_PATH,
+    ONNX_PATH,
+    INT8_ONNX_PATH,
+    PATCH_SIZE,
+)
+from patch_dataset import IGNORE_INDEX, remap_classes
+
+TRUTH_PATH = "../../assets/truth/truth.tif"
+
+# Sampled together and split alternately, so the two sets never share a patch
+CALIBRATION_PATCHES = 64
+EVAL_PATCHES = 64
+BATCH_SIZE = 8
+
+
+class PatchReader(CalibrationDataReader):
+    """Feeds calibration patches to the quantizer one batch at a time"""
+
+    def __init__(self, patches, input_name, batch_size=BATCH_SIZE):
+        self.batches = iter(
+            [
+                {input_name: patches[i : i + batch_size]}
+                for i in range(0, len(patches), batch_size)
+            ]
+        )
+
+    def get_next(self):
+        return next(self.batches, None)
+
+
+def read_labels(truth_path, src, windows):
+    """Remapped truth labels of windows, None when truth doesn't match src"""
+    if truth_path is None:
+        return None
+    if not os.path.exists(truth_path):
+        print(f"⚠ {truth_path} not found, only comparing int8 against fp32")
+        return None
+    with rasterio.open(truth_path) as truth:
+        if (truth.height, truth.width) != (src.height, src.width):
+            print(f"⚠ {truth_path} doesn't match the raster, skipping accuracy")
+            return None
+        return [
+            remap_classes(truth.read(1, window=window).astype(np.int64))
+            for window in windows
+        ]
+
+
+def valid_pixels(preds, labels):
+    """Flat predictions and labels of the labelled pixels inside each window"""
+    pred_pixels, label_pixels = [], []
+    for pred, label in zip(preds, labels):
+        height, width = label.shape
+        labelled = label != IGNORE_INDEX
+        pred_pixels.append(pred[:height, :width][labelled])
+        label_pixels.append(label[labelled])
+    return np.concatenate(pred_pixels), np.concatenate(label_pixels)
+
+
+def accuracy_report(fp32_preds, int8_preds, labels):
+    """Accuracy and per-class IoU of both models against truth"""
+    fp32_pixels, truth = valid_pixels(fp32_preds, labels)
+    int8_pixels, _ = valid_pixels(int8_preds, labels)
+    if len(truth) == 0:
+        print("⚠ Held-out patches have no labels, skipping accuracy")
+        return
+
+    fp32_accuracy = np.mean(fp32_pixels == truth)
+    int8_accuracy = np.mean(int8_pixels == truth)
+    print(
+        f"Accuracy against truth: fp32 {fp32_accuracy:.4f}, "
+        f"int8 {int8_accuracy:.4f} ({int8_accuracy - fp32_accuracy:+.4f})"
+    )
+    print("IoU against truth per class, fp32 / int8 (delta):")
+    fp32_ious = per_class_iou(fp32_pixels, truth)
+    int8_ious = per_class_iou(int8_pixels, truth)
+    for class_id, (fp32_iou, int8_iou) in enumerate(zip(fp32_ious, int8_ious)):
+        if fp32_iou is None and int8_iou is None:
+            print(f"  Class {class_id}: not present")
+            continue
+        fp32_iou, int8_iou = fp32_iou or 0.0, int8_iou or 0.0
+        print(
+            f"  Class {class_id}: {fp32_iou:.4f} / {int8_iou:.4f} "
+            f"({int8_iou - fp32_iou:+.4f})"
+        )
+
+
+def quantize(raw_path, onnx_path, int8_path, truth_path=TRUTH_PATH):
+    if not os.path.exists(onnx_path):
+        raise FileNotFoundError(f"{onnx_path} not found, run export-onnx.py first")
+
+    with rasterio.open(raw_path) as src:
+        windows = sample_windows(src, CALIBRATION_PATCHES + EVAL_PATCHES)
+        if len(windows) < 2:
+            raise ValueError("Need at least two non-empty patches to quantize")
+        # Every other window, so the report is not measured on calibration data
+        calibration_windows = windows[::2][:CALIBRATION_PATCHES]
+        held_out_windows = windows[1::2][:EVAL_PATCHES]
+        calibration = np.stack(
+            [read_patch(src, window, PATCH_SIZE) for window in calibration_windows]
+        )
+        held_out = np.stack(
+            [read_patch(src, window, PATCH_SIZE) for window in held_out_windows]
+        )
+        labels = read_labels(truth_path, src, held_out_windows)
+    print(f"🔍 {len(calibration)} calibration and {len(held_out)} held-out patches")
+
+    print("🚀 Quantizing to INT8...")
+    preprocessed = int8_path + ".pre.onnx"
+    quant_pre_process(onnx_path, preprocessed)
+    fp32 = OnnxModel(onnx_path)
+    quantize_static(
+        preprocessed,
+        int8_path,
+        PatchReader(calibration, fp32.input_name),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    os.remove(preprocessed)
+    print(f"✅ INT8 model saved as {int8_path}")
+
+    device = torch.device("cpu")
+    int8 = OnnxModel(int8_path)
+    reference, fp32_time = timed_predictions(fp32, held_out, device, BATCH_SIZE)
+    preds, int8_time = timed_predictions(int8, held_out, device, BATCH_SIZE)
+
+    print(f"\nfp32: {fp32_time:.2f}s, int8: {int8_time:.2f}s")
+    print(f"Speedup: {fp32_time / int8_time:.2f}x")
+    print(f"Agreement with fp32: {np.mean(reference == preds):.4f}")
+    if labels is not None:
+        accuracy_report(reference, preds, labels)
+
+
+if __name__ == "__main__":
+    raw_path = sys.argv[1] if len(sys.argv) > 1 else RAW_PATH
+    truth_path = sys.argv[2] if len(sys.argv) > 2 else TRUTH_PATH
+    quantize(raw_path, ONNX_PATH, INT8_ONNX_PATH, truth_path)
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import urllib.error
+import urllib.request
+from daemon import DAEMON_HOST, DAEMON_PORT
+
+STATUS_TIMEOUT_S = 2
+
+# Status of a daemon that accepted the connection but didn't answer in time
+BUSY = {"backend": "busy", "busy": True, "queued": None}
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def daemon_url(port, path):
+    return f"http://{DAEMON_HOST}:{port}{path}"
+
+
+def daemon_status(port):
+    """Status of a running use.py --serve, None if nothing is listening.
+
+    Only a refused connection means there is no daemon. One that accepts
+    but doesn't answer in time is a daemon busy with a job, and gets BUSY.
+    """
+    try:
+        with urllib.request.urlopen(
+            daemon_url(port, "/status"), timeout=STATUS_TIMEOUT_S
+        ) as response:
+            return json.load(response)
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, ConnectionRefusedError):
+            return None
+        return BUSY
+    except ConnectionRefusedError:
+        return None
+    except OSError:
+        return BUSY
+
+
+def submit(port, job):
+    """Post one job and return the daemon's reply, raising on job errors"""
+    request = urllib.request.Request(
+        daemon_url(port, "/jobs"),
+        data=json.dumps(job).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.load(e).get("error", str(e)))
+
+
+def parse_windows(value):
+    """col_off,row_off,width,height;... or a JSON file with a list of those"""
+    if os.path.exists(value):
+        with open(value, "r") as f:
+            return json.load(f)
+    return [[int(v) for v in window.split(",")] for window in value.split(";")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run a use.py job on the resident daemon, or in a new process"
+    )
+    parser.add_argument("--port", type=int, default=DAEMON_PORT)
+    parser.add_argument("--input")
+    parser.add_argument("--output")
+    parser.add_argument("--confidence")
+    parser.add_argument("--confidence-output")
+    parser.add_argument("--roi")
+    parser.add_argument("--roi-bbox")
+    parser.add_argument("--roi-mode")
+    parser.add_argument("--windows", type=parse_windows)
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--stats-json")
+    parser.add_argument(
+        "--no-fallback",
+        action="store_true",
+        help="fail instead of running use.py when no daemon is listening",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    job = {
+        option: value
+        for option, value in vars(args).items()
+        if value is not None and option not in ["port", "no_fallback"]
+    }
+    # The daemon resolves relative paths against its own working directory
+    for option in ["input", "output", "confidence_output", "stats_json"]:
+        if option in job:
+            job[option] = os.path.abspath(job[option])
+    if "roi" in job and os.path.exists(job["roi"]):
+        job["roi"] = os.path.abspath(job["roi"])
+
+    status = daemon_status(args.port)
+    if status is None:
+        if args.no_fallback:
+            print(f"❌ No daemon listening on port {args.port}")
+            sys.exit(1)
+        # Same job in a cold process, windows can only be given to the daemon
+        if "windows" in job:
+            print("❌ --windows needs a running daemon (python use.py --serve)")
+            sys.exit(1)
+        print("No daemon running, starting use.py...")
+        command = [sys.executable, os.path.join(SCRIPTS_DIR, "use.py")]
+        for option, value in job.items():
+            command += [f"--{option.replace('_', '-')}", str(value)]
+        sys.exit(subprocess.call(command))
+
+    print(f"🚀 Submitting to the daemon ({status['backend']}) on port {args.port}")
+    if status.get("busy"):
+        # The daemon queues jobs, this one runs when the current one is done
+        queued = status.get("queued")
+        ahead = f", {queued} more queued" if queued else ""
+        print(f"Daemon is busy with a job{ahead}, waiting for it to finish...")
+    try:
+        result = submit(args.port, job)
+    except RuntimeError as e:
+        print(f"❌ Job failed: {e}")
+        sys.exit(1)
+
+    timings = result["timings"]
+    stats = result["stats"]
+    inferred = stats["patches"] - stats["skipped"] - stats["cache_hits"]
+    print(
+        f"Inferred {inferred} patches, reused {stats['cache_hits']} cached, in "
+        f"{timings['inference_s']:.1f}s ({timings['total_s']:.1f}s total)"
+    )
+    print(f"✅ Landcover map saved at {result['output']}")
+    if result["confidence_output"]:
+        print(f"Confidence saved at {result['confidence_output']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import os
+import glob
+import json
+import time
+
+# -----------------------
+# Configuration
+# -----------------------
+CACHE_DIR = "../../assets/tiles"
+MANIFEST_NAME = "manifest.json"
+REQUESTS_NAME = "requests.json"
+CACHE_BUDGET_GB = 50
+
+
+def manifest_path(cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, MANIFEST_NAME)
+
+
+def load_manifest(cache_dir=CACHE_DIR):
+    """Load the tile manifest, registering any untracked tiles found on disk"""
+    manifest = {}
+    path = manifest_path(cache_dir)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            manifest = json.load(f)
+
+    # Drop entries whose file has disappeared
+    manifest = {
+        name: entry
+        for name, entry in manifest.items()
+        if os.path.exists(os.path.join(cache_dir, name))
+    }
+
+    # Tiles left over from before the cache existed
+    for tif in glob.glob(os.path.join(cache_dir, "*.tif")):
+        name = os.path.basename(tif)
+        if name not in manifest:
+            manifest[name] = {
+                "key": None,
+                "size": os.path.getsize(tif),
+                "last_access": os.path.getmtime(tif),
+            }
+
+    return manifest
+
+
+def save_manifest(manifest, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = manifest_path(cache_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def lookup(manifest, name, key=None, cache_dir=CACHE_DIR):
+    """Return the cached tile path and mark it as used, or None on a miss"""
+    entry = manifest.get(name)
+    if entry is None or entry["key"] != key:
+        return None
+
+    entry["last_access"] = time.time()
+    return os.path.join(cache_dir, name)
+
+
+def add(manifest, name, key=None, cache_dir=CACHE_DIR):
+    """Register a freshly written tile in the manifest"""
+    path = os.path.join(cache_dir, name)
+    manifest[name] = {
+        "key": key,
+        "size": os.path.getsize(path),
+        "last_access": time.time(),
+    }
+    return path
+
+
+def remove(manifest, name, cache_dir=CACHE_DIR):
+    """Delete a tile and its manifest entry, so a failed export can't leave it"""
+    path = os.path.join(cache_dir, name)
+    if os.path.exists(path):
+        os.remove(path)
+    manifest.pop(name, None)
+
+
+def save_request(year, key, cache_dir=CACHE_DIR):
+    """Remember which key the tiles of a year were last downloaded for"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, REQUESTS_NAME)
+    requests = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            requests = json.load(f)
+    requests[str(year)] = key
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(requests, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def request_key(year, cache_dir=CACHE_DIR):
+    """Key of the last download for a year, None if none was recorded"""
+    path = os.path.join(cache_dir, REQUESTS_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f).get(str(year))
+
+
+def touch(manifest, names):
+    now = time.time()
+    for name in names:
+        if name in manifest:
+            manifest[name]["last_access"] = now
+
+
+def evict(manifest, budget_bytes=None, keep=(), cache_dir=CACHE_DIR):
+    """Delete least recently used tiles until the cache fits in budget_bytes"""
+    if budget_bytes is None:
+        budget_bytes = int(CACHE_BUDGET_GB * 1024**3)
+
+    keep = set(keep)
+    total = sum(entry["size"] for entry in manifest.values())
+    removed = []
+
+    by_age = sorted(manifest.items(), key=lambda item: item[1]["last_access"])
+    for name, entry in by_age:
+        if total <= budget_bytes:
+            break
+        if name in keep:
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError as e:
+            print(f"Error removing {name}: {e}")
+            continue
+        total -= entry["size"]
+        removed.append(name)
+
+    for name in removed:
+        del manifest[name]
+
+    return removed, total
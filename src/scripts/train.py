@@ -1,13 +1,10 @@
 # No need to touch anything here :D
-import rasterio
-import numpy as np
 import torch
 import torch.nn as nn
 import os
-from torch.utils.data import Dataset, DataLoader
-from patchify import patchify
-from sklearn.model_selection import train_test_split
+from torch.utils.data import DataLoader
 import segmentation_models_pytorch as smp
+from patch_dataset import DATASET_DIR, PatchDataset, is_current, write_dataset
 
 # Configuration
 RAW_PATH = "../../assets/raw/raw.tif"
@@ -24,107 +21,6 @@ os.makedirs("truth", exist_ok=True)
 os.makedirs("raw", exist_ok=True)
 os.makedirs("models", exist_ok=True)
 
-# Original class values and mapping
-original_classes = [0, 1, 2, 5, 7, 8, 10, 11]
-class_mapping = {old: new for new, old in enumerate(original_classes)}
-max_class = max(original_classes)
-
-# Create lookup table for remapping
-lookup_table = np.full(max_class + 2, IGNORE_INDEX, dtype=np.int64)
-for old, new in class_mapping.items():
-    lookup_table[old] = new
-
-
-def remap_classes(mask_array):
-    """Remap classes using vectorized operations"""
-    clipped = np.clip(mask_array, 0, max_class + 1)
-    return lookup_table[clipped]
-
-
-def load_and_preprocess(image_path, mask_path):
-    # Load image and mask
-    with rasterio.open(image_path) as src:
-        image = src.read().transpose(1, 2, 0).astype(np.float32)
-        print(
-            f"Image stats - Min: {np.min(image)}, Max: {np.max(image)}, NaN count: {np.sum(np.isnan(image))}"
-        )
-
-        # Check for NaN values and replace them
-        if np.any(np.isnan(image)):
-            print("Warning: Image contains NaN values. Replacing with IGNORE_INDEX.")
-            image = np.nan_to_num(image, nan=IGNORE_INDEX)
-
-        # Normalize after handling NaN
-        image = np.clip(image, 0, 10000) / 10000.0
-        h_img, w_img, c = image.shape
-        assert c == 4, f"Expected 4 bands, got {c}"
-
-    with rasterio.open(mask_path) as src:
-        mask = src.read(1).astype(np.int64)
-        print(
-            f"Mask stats - Min: {np.min(mask)}, Max: {np.max(mask)}, NaN count: {np.sum(np.isnan(mask))}"
-        )
-
-        # Check for NaN values in mask
-        if np.any(np.isnan(mask)):
-            print("Warning: Mask contains NaN values. Replacing with IGNORE_INDEX.")
-            mask = np.nan_to_num(mask, nan=IGNORE_INDEX).astype(np.int64)
-
-        mask = remap_classes(mask)
-        h_mask, w_mask = mask.shape
-
-    # Rest of your function remains the same...
-    # Compute target dimensions (multiple of PATCH_SIZE)
-    h_target = ((max(h_img, h_mask) + PATCH_SIZE - 1) // PATCH_SIZE) * PATCH_SIZE
-    w_target = ((max(w_img, w_mask) + PATCH_SIZE - 1) // PATCH_SIZE) * PATCH_SIZE
-
-    # Pad image
-    pad_h_img = h_target - h_img
-    pad_w_img = w_target - w_img
-    image_padded = np.pad(
-        image, ((0, pad_h_img), (0, pad_w_img), (0, 0)), mode="reflect"
-    )
-
-    # Pad mask
-    pad_h_mask = h_target - h_mask
-    pad_w_mask = w_target - w_mask
-    mask_padded = np.pad(
-        mask,
-        ((0, pad_h_mask), (0, pad_w_mask)),
-        mode="constant",
-        constant_values=IGNORE_INDEX,
-    )
-
-    # Final check
-    print(
-        f"Final image stats - Min: {np.min(image_padded)}, Max: {np.max(image_padded)}, NaN count: {np.sum(np.isnan(image_padded))}"
-    )
-    print(
-        f"Final mask stats - Min: {np.min(mask_padded)}, Max: {np.max(mask_padded)}, NaN count: {np.sum(np.isnan(mask_padded))}"
-    )
-
-    return image_padded, mask_padded
-
-
-class LandCoverDataset(Dataset):
-    def __init__(self, images, masks):
-        self.images = images
-        self.masks = masks
-        self.valid_indices = [
-            i for i, m in enumerate(masks) if not np.all(m == IGNORE_INDEX)
-        ]
-
-    def __len__(self):
-        return len(self.valid_indices)
-
-    def __getitem__(self, idx):
-        actual_idx = self.valid_indices[idx]
-        image = torch.tensor(
-            self.images[actual_idx].transpose(2, 0, 1), dtype=torch.float32
-        )
-        mask = torch.tensor(self.masks[actual_idx], dtype=torch.long)
-        return image, mask
-
 
 def calculate_iou(preds, labels, num_classes, ignore_index):
     # Filter out ignore index
@@ -147,36 +43,15 @@ def calculate_iou(preds, labels, num_classes, ignore_index):
 
 
 def main():
-    # Load and process data
-    image, mask = load_and_preprocess(RAW_PATH, TRUTH_PATH)
-
-    # Verify classes
-    unique = np.unique(mask)
-    print("Unique values after remapping:", unique)
-    assert all(
-        (0 <= c < NUM_CLASSES) or (c == IGNORE_INDEX) for c in unique
-    ), "Invalid class values"
-
-    # Extract patches
-    image_patches = patchify(
-        image, (PATCH_SIZE, PATCH_SIZE, 4), step=PATCH_SIZE
-    ).reshape(-1, PATCH_SIZE, PATCH_SIZE, 4)
-    mask_patches = patchify(mask, (PATCH_SIZE, PATCH_SIZE), step=PATCH_SIZE).reshape(
-        -1, PATCH_SIZE, PATCH_SIZE
-    )
-
-    # Split dataset
-    X_train, X_temp, y_train, y_temp = train_test_split(
-        image_patches, mask_patches, test_size=0.3, random_state=42
-    )
-    X_val, X_test, y_val, y_test = train_test_split(
-        X_temp, y_temp, test_size=0.5, random_state=42
-    )
+    # Patches come from memory-mapped shards, rebuilt whenever the rasters change
+    if not is_current(RAW_PATH, TRUTH_PATH, DATASET_DIR, PATCH_SIZE):
+        print("Patch shards missing or older than the rasters, writing them...")
+        write_dataset(RAW_PATH, TRUTH_PATH, DATASET_DIR, patch_size=PATCH_SIZE)
 
     # Create datasets and dataloaders
-    train_dataset = LandCoverDataset(X_train, y_train)
-    val_dataset = LandCoverDataset(X_val, y_val)
-    test_dataset = LandCoverDataset(X_test, y_test)
+    train_dataset = PatchDataset(DATASET_DIR, "train")
+    val_dataset = PatchDataset(DATASET_DIR, "val")
+    test_dataset = PatchDataset(DATASET_DIR, "test")
 
     train_loader = DataLoader(
         train_dataset, batch_size=BATCH_SIZE, shuffle=True, pin_memory=True
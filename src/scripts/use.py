@@ -2,113 +2,2041 @@ import torch
 import rasterio
 import numpy as np
 import os
-from patchify import patchify, unpatchify
-import segmentation_models_pytorch as smp
+import sys
+import json
+import time
+import glob
+import argparse
+import platform
+import contextlib
+import queue
+import threading
+from rasterio.windows import Window, bounds as window_bounds, union as window_union
 from datetime import datetime
+from patch_cache import CACHE_PATH, CACHE_BUDGET_MB, file_digest
+from daemon import DAEMON_PORT, serve
+from block_cache import (
+    BLOCK_CACHE_MB,
+    PATCH_ORDERS,
+    BlockCache,
+    CachedReader,
+    schedule_windows,
+)
 
 RAW_PATH = "../../assets/raw/raw.tif"
 OUTPUT_PATH = "../../assets/truth/truth.tif"
 CHECKPOINT_PATH = "../../model/model.pth"
+ONNX_PATH = "../../model/model.onnx"
+INT8_ONNX_PATH = "../../model/model.int8.onnx"
 PATCH_SIZE = 256
 NUM_CLASSES = 8
+ENCODER_NAME = "efficientnet-b4"
+
+# Upper bound for GDAL's block cache, the rest of the loop works on one batch.
+# The BLOCK_CACHE_MB of decoded blocks comes out of it, GDAL gets the rest.
+MEMORY_BUDGET_MB = 512
+
+# Patches per forward pass, 0 picks the fastest size on this machine
+BATCH_SIZE = 8
+MAX_AUTO_BATCH_SIZE = 64
+
+# Class written for patches that are entirely outside the cutline
+NODATA_CLASS = 0
+
+# Sliding-window overlap in pixels, 0 keeps the non-overlapping patch grid
+OVERLAP = 0
+BLEND_MODES = ["gaussian", "linear"]
+
+# Reduced precision runs under autocast, fp16 only where the device supports it
+PRECISIONS = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}
+COMPARE_SAMPLE_PATCHES = 32
+
+BACKENDS = ["torch", "onnx", "int8"]
+
+# Test-time augmentation: (forward, inverse) pairs over the H, W axes
+TTA_TRANSFORMS = {
+    "identity": (lambda x: x, lambda y: y),
+    "hflip": (lambda x: x.flip(3), lambda y: y.flip(3)),
+    "vflip": (lambda x: x.flip(2), lambda y: y.flip(2)),
+    "rot90": (lambda x: x.rot90(1, (2, 3)), lambda y: y.rot90(-1, (2, 3))),
+    "rot180": (lambda x: x.rot90(2, (2, 3)), lambda y: y.rot90(-2, (2, 3))),
+    "rot270": (lambda x: x.rot90(3, (2, 3)), lambda y: y.rot90(-3, (2, 3))),
+    "transpose": (lambda x: x.transpose(2, 3), lambda y: y.transpose(2, 3)),
+    "antitranspose": (
+        lambda x: x.transpose(2, 3).flip(2, 3),
+        lambda y: y.flip(2, 3).transpose(2, 3),
+    ),
+}
+TTA_PRESETS = {
+    "none": ["identity"],
+    "flips": ["identity", "hflip", "vflip"],
+    "d4": list(TTA_TRANSFORMS),
+}
+
+# Two-pass mode: patches the model is sure are one class at 1/COARSE_FACTOR
+# resolution skip the full-resolution pass. PATCH_SIZE / COARSE_FACTOR must
+# stay a multiple of 32 for the U-Net.
+COARSE_FACTORS = [2, 4, 8]
+COARSE_FACTOR = 4
+HOMOGENEOUS_CONFIDENCE = 0.9
+
+# Worker processes for sharded inference, each takes one band of patch rows
+WORKERS = 1
+
+# Background reader threads and how many batches they may read ahead
+PREFETCH_THREADS = 2
+PREFETCH_DEPTH = 2
+
+# Optional per-pixel confidence, stored as uint8 (0-255 for 0.0-1.0)
+CONFIDENCE_PATH = "../../assets/truth/confidence.tif"
+CONFIDENCE_MODES = ["none", "top1", "margin"]
+
+# Region of interest: boundary names are looked up here, bboxes are lon/lat
+BOUNDARIES_DIR = "../../assets/boundaries"
+ROI_OUTPUT_DIR = "../../assets/truth/roi"
+ROI_MODES = ["standalone", "update"]
+
+# Batch size, thread and worker counts picked by autotune.py for this machine
+PROFILE_DIR = "../../model/profiles"
+TUNED_SETTINGS = ["batch_size", "intra_op_threads", "inter_op_threads", "workers"]
+
+# torch.compile artifacts, one folder per torch version and weights hash
+COMPILE_CACHE_DIR = "../../model/compile"
+COMPILE_ARTIFACTS_NAME = "artifacts.bin"
+
+# Options a job posted to the daemon (--serve) may set, see daemon.py
+JOB_OPTIONS = [
+    "input",
+    "output",
+    "confidence",
+    "confidence_output",
+    "roi",
+    "roi_bbox",
+    "roi_mode",
+    "windows",
+    "batch_size",
+    "stats_json",
+]
 
 original_classes = [0, 1, 2, 5, 7, 8, 10, 11]
 remapped_classes = list(range(NUM_CLASSES))
 class_mapping = {new: old for new, old in enumerate(original_classes)}
 
 
-def load_raw_image(path):
-    """Load raw satellite image and normalize"""
-    with rasterio.open(path) as src:
-        image = src.read().transpose(1, 2, 0).astype(np.float32)
-        profile = src.profile
+def normalize_into(raw, out):
+    """Clip and normalize raw reflectance values into the float32 array out"""
+    out[...] = raw
+    np.clip(out, 0, 10000, out=out)
+    np.divide(out, 10000.0, out=out)
 
-    # Clip and normalize
-    image = np.clip(image, 0, 10000) / 10000.0
-    return image, profile
 
+def reflected_indices(offset, size, length):
+    """Raster rows (or columns) of a patch, reflected past the raster's edge.
 
-def pad_image(image, patch_size):
-    """Pad image to be divisible by patch_size"""
-    h, w, c = image.shape
-    h_target = ((h + patch_size - 1) // patch_size) * patch_size
-    w_target = ((w + patch_size - 1) // patch_size) * patch_size
+    Same pixels as np.pad(mode="reflect") of the whole raster, the way the
+    original pipeline and train.py's dataset pad, without the padded copy.
+    """
+    past_edge = max(0, offset + size - length)
+    indices = np.pad(np.arange(length), (0, past_edge), mode="reflect")
+    return indices[offset : offset + size]
 
-    pad_h = h_target - h
-    pad_w = w_target - w
-    image_padded = np.pad(image, ((0, pad_h), (0, pad_w), (0, 0)), mode="reflect")
-    return image_padded, (h, w)
 
+def iter_windows(height, width, patch_size):
+    """Yield PATCH_SIZE-aligned windows in row-major order, clipped at the edges"""
+    for row in range(0, height, patch_size):
+        for col in range(0, width, patch_size):
+            yield Window(
+                col,
+                row,
+                min(patch_size, width - col),
+                min(patch_size, height - row),
+            )
 
-def main():
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+def resolve_boundary(value):
+    """Path to a boundary .gpkg, or the name of one under BOUNDARIES_DIR"""
+    if os.path.exists(value):
+        return value
+    name = os.path.splitext(os.path.basename(value))[0].lower()
+    pattern = os.path.join(BOUNDARIES_DIR, "**", "*.gpkg")
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        if os.path.splitext(os.path.basename(path))[0].lower() == name:
+            return path
+    raise argparse.ArgumentTypeError(f"no boundary named {value} in {BOUNDARIES_DIR}")
 
-    # Load image
-    image, profile = load_raw_image(RAW_PATH)
-    image_padded, (orig_h, orig_w) = pad_image(image, PATCH_SIZE)
 
-    # Patchify
-    patches = patchify(
-        image_padded, (PATCH_SIZE, PATCH_SIZE, 4), step=PATCH_SIZE
-    ).reshape(-1, PATCH_SIZE, PATCH_SIZE, 4)
+def parse_bbox(value):
+    """min_lon,min_lat,max_lon,max_lat"""
+    try:
+        bbox = [float(v) for v in value.split(",")]
+    except ValueError:
+        bbox = []
+    if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+        raise argparse.ArgumentTypeError("expected min_lon,min_lat,max_lon,max_lat")
+    return bbox
 
-    # Load model
-    model = smp.Unet(
-        encoder_name="efficientnet-b4",
+
+def roi_geometry(args, crs):
+    """Union of the --roi boundary or the --roi-bbox, in the raster's CRS"""
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    if args.roi:
+        boundary = gpd.read_file(args.roi)
+    else:
+        boundary = gpd.GeoDataFrame(geometry=[box(*args.roi_bbox)], crs="EPSG:4326")
+    return boundary.to_crs(crs).geometry.union_all()
+
+
+def roi_windows(src, geometry, patch_size=PATCH_SIZE):
+    """Patch windows of src that intersect geometry, in row-major order"""
+    from shapely.geometry import box
+    from shapely.prepared import prep
+
+    prepared = prep(geometry)
+    min_x, min_y, max_x, max_y = geometry.bounds
+    windows = []
+    for window in iter_windows(src.height, src.width, patch_size):
+        left, bottom, right, top = window_bounds(window, src.transform)
+        # Cheap bbox test first, most windows are far from the boundary
+        if right < min_x or left > max_x or top < min_y or bottom > max_y:
+            continue
+        if prepared.intersects(box(left, bottom, right, top)):
+            windows.append(window)
+    return windows
+
+
+def is_nodata(raw, nodata):
+    """True when every pixel of every band equals the nodata value"""
+    return nodata is not None and not np.any(raw != nodata)
+
+
+def read_patch(src, window, patch_size):
+    """Read one window and pad edge windows up to a full patch, None if empty"""
+    patch = np.empty((src.count, patch_size, patch_size), np.float32)
+    if read_patch_into(src, window, patch) is None:
+        return None
+    return patch
+
+
+def read_patch_into(src, window, out, scratch=None):
+    """Read one window into the (bands, patch, patch) float32 array out.
+
+    Full windows are read into scratch, a reusable array of the raster's
+    dtype. Smaller windows are filled from the pixels that follow them in
+    the raster, reflected past its edge. Returns the raw patch, padding
+    included, or None without touching out when the window is all nodata.
+    """
+    height, width = window.height, window.width
+    size_h, size_w = out.shape[1:]
+    if (height, width) == (size_h, size_w):
+        if scratch is not None and scratch.shape[1:] == (height, width):
+            raw = src.read(window=window, out=scratch)
+        else:
+            raw = src.read(window=window)
+        if is_nodata(raw, src.nodata):
+            return None
+        normalize_into(raw, out)
+        return raw
+
+    top, left = window.row_off, window.col_off
+    rows = reflected_indices(top, size_h, src.height)
+    cols = reflected_indices(left, size_w, src.width)
+    # Reflecting can reach back past the window's own top or left edge
+    row0, col0 = rows.min(), cols.min()
+    context = src.read(
+        window=Window(col0, row0, cols.max() - col0 + 1, rows.max() - row0 + 1)
+    )
+    y0, x0 = top - row0, left - col0
+    own = context[:, y0 : y0 + height, x0 : x0 + width]
+    if is_nodata(own, src.nodata):
+        return None
+
+    raw = context[:, rows - row0][:, :, cols - col0]
+    normalize_into(raw, out)
+    return raw
+
+
+def open_block_cache(args):
+    """BlockCache for one inference run, None when --block-cache-mb is 0"""
+    if args.block_cache_mb <= 0:
+        return None
+    return BlockCache(args.block_cache_mb)
+
+
+def gdal_cache_mb(args):
+    """What is left of MEMORY_BUDGET_MB for GDAL next to the block cache"""
+    return int(max(16, MEMORY_BUDGET_MB - max(0, args.block_cache_mb)))
+
+
+def raw_scratch(src, patch_size):
+    """Reusable array for reading one full window of src"""
+    return np.empty((src.count, patch_size, patch_size), src.dtypes[0])
+
+
+def output_profile(profile, patch_size):
+    """Tiled single-band profile so each patch is written as whole blocks"""
+    profile = profile.copy()
+    profile.update(
+        dtype=rasterio.uint8,
+        count=1,
+        compress="lzw",
+        tiled=True,
+        blockxsize=patch_size,
+        blockysize=patch_size,
+        BIGTIFF="IF_SAFER",
+    )
+    profile.pop("interleave", None)
+    return profile
+
+
+def slim_checkpoint_path(checkpoint_path):
+    """model.pth -> model.slim.pth"""
+    root, ext = os.path.splitext(checkpoint_path)
+    return f"{root}.slim{ext}"
+
+
+def save_slim_checkpoint(checkpoint, slim_path):
+    """Write weights and metadata only, without the optimizer state"""
+    slim = {
+        "model_state_dict": {
+            key: value.cpu() for key, value in checkpoint["model_state_dict"].items()
+        },
+        "epoch": checkpoint.get("epoch"),
+        "val_loss": checkpoint.get("val_loss"),
+        "encoder_name": checkpoint.get("encoder_name", ENCODER_NAME),
+    }
+    tmp_path = slim_path + ".tmp"
+    torch.save(slim, tmp_path)
+    os.replace(tmp_path, slim_path)
+
+
+def build_unet(encoder_name=ENCODER_NAME):
+    # Imported here so backends that don't build the graph skip the import cost
+    import segmentation_models_pytorch as smp
+
+    return smp.Unet(
+        encoder_name=encoder_name,
         encoder_weights=None,
         in_channels=4,
         classes=NUM_CLASSES,
-    ).to(device)
+    )
+
+
+def load_model(checkpoint_path, device):
+    """Build the U-Net and load its weights, from the slim artifact when current.
+
+    The training checkpoint also carries the optimizer state, so the first
+    load after train.py writes a new model.pth saves a weights-only copy
+    next to it. Later loads mmap that copy and build the model on the meta
+    device, skipping both the random initialisation and a weight copy.
+    """
+    start = time.perf_counter()
+    slim_path = slim_checkpoint_path(checkpoint_path)
+    slim_is_current = os.path.exists(slim_path) and (
+        not os.path.exists(checkpoint_path)
+        or os.path.getmtime(slim_path) >= os.path.getmtime(checkpoint_path)
+    )
+
+    # Checkpoints without an encoder_name come from train.py's EfficientNet-B4
+    if slim_is_current:
+        checkpoint = torch.load(
+            slim_path, map_location=device, mmap=True, weights_only=True
+        )
+        with torch.device("meta"):
+            model = build_unet(checkpoint.get("encoder_name", ENCODER_NAME))
+        model.load_state_dict(checkpoint["model_state_dict"], assign=True)
+        source = slim_path
+    else:
+        checkpoint = torch.load(checkpoint_path, map_location=device)
+        model = build_unet(checkpoint.get("encoder_name", ENCODER_NAME)).to(device)
+        model.load_state_dict(checkpoint["model_state_dict"])
+        save_slim_checkpoint(checkpoint, slim_path)
+        source = checkpoint_path
 
-    # Load checkpoint
-    checkpoint = torch.load(CHECKPOINT_PATH, map_location=device)
-    model.load_state_dict(checkpoint["model_state_dict"])
     model.eval()
+    print(f"Model loaded from {source} in {time.perf_counter() - start:.2f}s")
+    return model, checkpoint
 
-    preds = []
+
+class OnnxModel:
+    """ONNX Runtime session that is called like the torch model"""
+
+    def __init__(self, onnx_path, intra_op_threads=0, inter_op_threads=0):
+        import onnxruntime as ort
+
+        self.onnx_path = onnx_path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        providers = ["CPUExecutionProvider"]
+        if "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+
+        self.session = ort.InferenceSession(onnx_path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        # Written by export-onnx.py, same keys as the training checkpoint
+        self.metadata = self.session.get_modelmeta().custom_metadata_map
+
+    def __call__(self, x):
+        output = self.session.run(None, {self.input_name: x.cpu().numpy()})[0]
+        return torch.from_numpy(output)
+
+    # Sessions can't be pickled, worker processes open their own from the file
+    def __getstate__(self):
+        return {
+            "onnx_path": self.onnx_path,
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class PrecisionModel(torch.nn.Module):
+    """Runs the wrapped model under autocast and in channels_last if asked to"""
+
+    def __init__(self, model, device, precision="fp32", channels_last=False):
+        super().__init__()
+        self.model = model
+        self.device_type = device.type
+        self.dtype = PRECISIONS[precision]
+        self.channels_last = channels_last
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+
+        if self.dtype == torch.float32:
+            autocast = contextlib.nullcontext()
+        else:
+            autocast = torch.autocast(self.device_type, dtype=self.dtype)
+        with autocast:
+            output = self.model(x)
+        return output.float()
+
+
+class TTAModel(torch.nn.Module):
+    """Averages logits over augmented views, run as a single forward pass.
+
+    A batch of N patches becomes one batch of N * len(transforms) views, so
+    memory per forward pass grows with the number of transforms.
+    """
+
+    def __init__(self, model, transforms):
+        super().__init__()
+        self.model = model
+        self.transforms = transforms
+
+    def forward(self, x):
+        views = torch.cat([TTA_TRANSFORMS[name][0](x) for name in self.transforms])
+        output = self.model(views.contiguous())
+
+        logits = 0
+        for name, chunk in zip(self.transforms, output.chunk(len(self.transforms))):
+            logits = logits + TTA_TRANSFORMS[name][1](chunk)
+        return logits / len(self.transforms)
+
+
+class CompiledModel(torch.nn.Module):
+    """torch.compile'd model for one fixed (batch_size, 4, patch, patch) shape.
+
+    Shorter batches (the last one, or the misses left by the patch cache)
+    are padded up to batch_size so they reuse the same compiled graph
+    instead of triggering a recompile.
+    """
+
+    def __init__(self, model, batch_size):
+        super().__init__()
+        self.model = model
+        self.batch_size = batch_size
+        self.compiled = torch.compile(model, dynamic=False)
+        self.compile_s = None
+
+    def forward(self, x):
+        n = x.shape[0]
+        if n < self.batch_size:
+            padding = x.new_zeros((self.batch_size - n, *x.shape[1:]))
+            x = torch.cat([x, padding])
+        return self.compiled(x)[:n]
+
+
+def compile_cache_dir(args):
+    """Compile cache folder for this torch version and these weights"""
+    digest = "-".join(file_digest(path)[:16] for path in weight_paths(args))
+    return os.path.join(args.compile_cache_dir, torch.__version__, digest)
+
+
+def compile_model(model, args, device, patch_size=PATCH_SIZE):
+    """Compile model with inductor for args.batch_size, reusing cached artifacts.
+
+    Inductor's own cache goes in the folder from compile_cache_dir, and the
+    portable artifacts saved after the first compile are loaded up front
+    on later runs, so only the first run for a given model and torch
+    version pays the full compile time.
+    """
+    cache_dir = compile_cache_dir(args)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.abspath(cache_dir)
+    artifacts_path = os.path.join(cache_dir, COMPILE_ARTIFACTS_NAME)
+    cached = os.path.exists(artifacts_path)
+    if cached:
+        with open(artifacts_path, "rb") as f:
+            torch.compiler.load_cache_artifacts(f.read())
+
+    model = CompiledModel(model, args.batch_size)
+    print(f"Compiling for batch size {args.batch_size}...")
+    start = time.perf_counter()
     with torch.no_grad():
-        for patch in patches:
-            tensor = (
-                torch.tensor(patch.transpose(2, 0, 1), dtype=torch.float32)
-                .unsqueeze(0)
-                .to(device)
+        warmup = np.zeros((args.batch_size, 4, patch_size, patch_size), np.float32)
+        predict_batch(model, warmup, device)
+    model.compile_s = time.perf_counter() - start
+    print(
+        f"Compiled in {model.compile_s:.1f}s "
+        f"({'cached' if cached else 'cold'}, cache at {cache_dir})"
+    )
+
+    if not cached:
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is not None:
+            with open(artifacts_path, "wb") as f:
+                f.write(artifacts[0])
+    return model
+
+
+class EnsembleModel(torch.nn.Module):
+    """Weighted mean of the logits of several models on the same batch"""
+
+    def __init__(self, models, weights):
+        super().__init__()
+        self.models = torch.nn.ModuleList(models)
+        self.weights = [weight / sum(weights) for weight in weights]
+
+    def forward(self, x):
+        logits = 0
+        for model, weight in zip(self.models, self.weights):
+            logits = logits + weight * model(x)
+        return logits
+
+
+def ensemble_weights(value, checkpoints):
+    """mean, val_loss (weights proportional to 1 / val_loss) or a weight list"""
+    if value == "mean":
+        return [1.0] * len(checkpoints)
+    if value == "val_loss":
+        losses = [checkpoint.get("val_loss") for checkpoint in checkpoints]
+        if any(loss is None or loss <= 0 for loss in losses):
+            raise ValueError(
+                f"val_loss weighting needs a val_loss in every checkpoint, got {losses}"
             )
-            output = model(tensor)
-            pred = torch.argmax(output, dim=1).squeeze(0).cpu().numpy()
-            preds.append(pred)
+        return [1.0 / loss for loss in losses]
+
+    weights = [float(weight) for weight in value.split(",")]
+    if len(weights) != len(checkpoints) or min(weights) < 0 or sum(weights) <= 0:
+        raise ValueError(
+            f"expected {len(checkpoints)} non-negative --ensemble-weights, got {value}"
+        )
+    return weights
+
+
+def parse_tta(value):
+    """Preset name or comma separated transform names"""
+    if value in TTA_PRESETS:
+        return TTA_PRESETS[value]
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in TTA_TRANSFORMS]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(
+            f"unknown TTA transforms {unknown}, choose from "
+            f"{list(TTA_PRESETS)} or {list(TTA_TRANSFORMS)}"
+        )
+    return names
+
+
+def resolve_precision(precision, device):
+    """Fall back to fp32 when the device cannot run the requested precision"""
+    if precision == "fp16" and device.type == "cpu":
+        print("fp16 autocast is not supported on CPU, using fp32")
+        return "fp32"
+    if precision == "bf16" and device.type == "cuda":
+        if not torch.cuda.is_bf16_supported():
+            print("bf16 is not supported on this GPU, using fp32")
+            return "fp32"
+    return precision
+
+
+def iter_batches(
+    src, windows, batch_size, patch_size, key_fn=None, block_cache=None
+):
+    """Group windows into (batch, windows, keys), the last batch may be partial.
+
+    Windows that are entirely nodata are yielded on their own as
+    (None, [window], None) so the caller can fill them without running the
+    model. keys holds key_fn of each raw patch, or is None without key_fn.
+    Patches are read into one reused buffer, so callers must be done with
+    a batch before asking for the next one.
+    """
+    if block_cache is not None:
+        src = CachedReader(src, block_cache)
+    buffer = np.empty((batch_size, src.count, patch_size, patch_size), np.float32)
+    scratch = raw_scratch(src, patch_size)
+    batch_windows, keys = [], []
+    for window in windows:
+        raw = read_patch_into(src, window, buffer[len(batch_windows)], scratch)
+        if raw is None:
+            yield None, [window], None
+            continue
+
+        batch_windows.append(window)
+        keys.append(key_fn(raw) if key_fn else None)
+        if len(batch_windows) == batch_size:
+            yield buffer, batch_windows, keys if key_fn else None
+            batch_windows, keys = [], []
+
+    if batch_windows:
+        n = len(batch_windows)
+        yield buffer[:n], batch_windows, keys if key_fn else None
+
+
+def new_stats():
+    """Counters shared by all inference paths, the waits are in seconds"""
+    return {
+        "patches": 0,
+        "skipped": 0,
+        "compute_wait": 0.0,
+        "read_wait": 0.0,
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "coarse_skipped": 0,
+        "block_reads": 0,
+    }
+
+
+def print_stats(stats):
+    # Cache hits and nodata patches never reach the model
+    inferred = stats["patches"] - stats["skipped"] - stats["cache_hits"]
+    print(
+        f"Inferred {inferred} patches, reused {stats['cache_hits']} cached, "
+        f"skipped {stats['skipped']}/{stats['patches']} nodata patches"
+    )
+    # Model waiting on reads means I/O bound, readers waiting on buffers compute bound
+    print(
+        f"Model waited {stats['compute_wait']:.1f}s for reads, "
+        f"readers waited {stats['read_wait']:.1f}s for free buffers"
+    )
+    if stats["block_reads"]:
+        print(
+            f"Read {stats['block_reads']} file blocks for {stats['patches']} patches "
+            f"({stats['block_reads'] / stats['patches']:.2f} per patch)"
+        )
+    if stats["coarse_skipped"]:
+        print(
+            f"Coarse pass settled {stats['coarse_skipped']}/{inferred} patches "
+            f"({stats['coarse_skipped'] / inferred:.1%}) without the full model"
+        )
+    lookups = stats["cache_hits"] + stats["cache_misses"]
+    if lookups:
+        print(
+            f"Patch cache hit rate: {stats['cache_hits'] / lookups:.1%} "
+            f"({stats['cache_hits']}/{lookups})"
+        )
+
+
+def prefetch_batches(
+    input_path,
+    windows,
+    batch_size,
+    stats,
+    threads,
+    depth,
+    patch_size=PATCH_SIZE,
+    key_fn=None,
+    block_cache=None,
+):
+    """Read and normalize batches on background threads while the model runs.
+
+    Batches are filled into depth + 1 reusable buffers (pinned when a GPU is
+    used), so at most depth batches are read ahead of the one being inferred.
+    A buffer goes back to the readers when the caller asks for the next batch,
+    so callers must be done with a batch before advancing the generator.
+    Batches come out in whatever order the readers finish them.
+    """
+    pin_memory = torch.cuda.is_available()
+    buffers = [
+        torch.empty(
+            (batch_size, 4, patch_size, patch_size), pin_memory=pin_memory
+        ).numpy()
+        for _ in range(depth + 1)
+    ]
+    free = queue.Queue()
+    for index in range(len(buffers)):
+        free.put(index)
+    ready = queue.Queue()
+    lock = threading.Lock()
+    stop = threading.Event()
+    windows = iter(windows)
+    done = object()
+
+    def reader():
+        try:
+            with rasterio.open(input_path) as src:
+                if block_cache is not None:
+                    src = CachedReader(src, block_cache)
+                scratch = raw_scratch(src, patch_size)
+                exhausted = False
+                while not exhausted and not stop.is_set():
+                    start = time.perf_counter()
+                    index = free.get()
+                    with lock:
+                        stats["read_wait"] += time.perf_counter() - start
+
+                    batch_windows, keys = [], []
+                    while len(batch_windows) < batch_size:
+                        with lock:
+                            window = next(windows, None)
+                        if window is None:
+                            exhausted = True
+                            break
+                        out = buffers[index][len(batch_windows)]
+                        raw = read_patch_into(src, window, out, scratch)
+                        if raw is None:
+                            ready.put((None, [window], None))
+                            continue
+                        batch_windows.append(window)
+                        keys.append(key_fn(raw) if key_fn else None)
+
+                    if batch_windows:
+                        ready.put((index, batch_windows, keys if key_fn else None))
+                    else:
+                        free.put(index)
+        except Exception as e:
+            ready.put(e)
+        finally:
+            ready.put(done)
+
+    readers = [threading.Thread(target=reader, daemon=True) for _ in range(threads)]
+    for thread in readers:
+        thread.start()
+
+    finished = 0
+    try:
+        while finished < len(readers):
+            start = time.perf_counter()
+            item = ready.get()
+            stats["compute_wait"] += time.perf_counter() - start
+
+            if item is done:
+                finished += 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+
+            index, batch_windows, keys = item
+            if index is None:
+                yield None, batch_windows, None
+                continue
+            yield buffers[index][: len(batch_windows)], batch_windows, keys
+            free.put(index)
+    finally:
+        # Let readers blocked on a free buffer see the stop flag
+        stop.set()
+        for index in range(len(readers)):
+            free.put(index)
+
+
+def read_batches(
+    src,
+    windows,
+    batch_size,
+    stats,
+    prefetch=None,
+    patch_size=PATCH_SIZE,
+    key_fn=None,
+    block_cache=None,
+):
+    """Batches from background readers when prefetch = (threads, depth) is set"""
+    if prefetch and prefetch[0] > 0:
+        threads, depth = prefetch
+        return prefetch_batches(
+            src.name,
+            windows,
+            batch_size,
+            stats,
+            threads,
+            depth,
+            patch_size,
+            key_fn,
+            block_cache,
+        )
+    return iter_batches(src, windows, batch_size, patch_size, key_fn, block_cache)
+
+
+def predict_logits(model, batch, device):
+    """Run one (N, 4, H, W) batch through the model"""
+    tensor = torch.from_numpy(batch).to(device)
+    return model(tensor)
+
+
+def predict_batch(model, batch, device):
+    """Run one (N, 4, H, W) batch through the model and return uint8 classes"""
+    output = predict_logits(model, batch, device)
+    # NUM_CLASSES fits in uint8, so only a byte per pixel leaves the device
+    return torch.argmax(output, dim=1).to(torch.uint8).cpu().numpy()
+
+
+def confidence_from_logits(logits, mode):
+    """Top-1 probability or top-1/top-2 margin of (N, C, H, W) logits as uint8"""
+    probs = torch.softmax(logits.float(), dim=1)
+    if mode == "top1":
+        value = probs.max(dim=1).values
+    else:
+        top2 = probs.topk(2, dim=1).values
+        value = top2[:, 0] - top2[:, 1]
+    return (value * 255).round().to(torch.uint8)
+
+
+def predict_batch_confidence(model, batch, device, mode):
+    """Class indices and uint8 confidence, computed before leaving the device"""
+    output = predict_logits(model, batch, device)
+    preds = torch.argmax(output, dim=1).to(torch.uint8).cpu().numpy()
+    confidence = confidence_from_logits(output, mode).cpu().numpy()
+    return preds, confidence
+
+
+def predict_two_pass(model, batch, windows, device, args):
+    """Coarse pass over downsampled patches, the full model only where needed.
+
+    A patch whose coarse prediction is one class everywhere, each coarse
+    pixel at least args.homogeneous_confidence sure of it, is filled with
+    that class. Returns per-patch uint8 predictions, confidences (None
+    without --confidence) and how many patches the coarse pass settled.
+    """
+    factor = args.coarse_factor
+    with torch.no_grad():
+        x = torch.from_numpy(batch).to(device)
+        coarse = model(torch.nn.functional.avg_pool2d(x, factor)).float()
+        top, classes = torch.softmax(coarse, dim=1).max(dim=1)
+
+    preds = [None] * len(windows)
+    confidences = [None] * len(windows)
+    full = []
+    for i, window in enumerate(windows):
+        # Only look at the part of edge patches that is inside the raster
+        height, width = -(-window.height // factor), -(-window.width // factor)
+        patch_classes = classes[i, :height, :width]
+        if not (
+            bool((patch_classes == patch_classes[0, 0]).all())
+            and float(top[i, :height, :width].min()) >= args.homogeneous_confidence
+        ):
+            full.append(i)
+            continue
+
+        size = batch.shape[-1]
+        preds[i] = np.full((size, size), int(patch_classes[0, 0]), np.uint8)
+        if args.confidence != "none":
+            confidence = confidence_from_logits(coarse[i : i + 1], args.confidence)[0]
+            confidence = confidence.repeat_interleave(factor, 0)
+            confidences[i] = confidence.repeat_interleave(factor, 1).cpu().numpy()
+
+    if full:
+        subset = batch[full] if len(full) < len(windows) else batch
+        if args.confidence == "none":
+            full_preds = predict_batch(model, subset, device)
+            full_confidences = [None] * len(full)
+        else:
+            full_preds, full_confidences = predict_batch_confidence(
+                model, subset, device, args.confidence
+            )
+        for j, i in enumerate(full):
+            preds[i], confidences[i] = full_preds[j], full_confidences[j]
+
+    return preds, confidences, len(windows) - len(full)
+
+
+def compare_two_pass(model, src, device, args):
+    """Skipped fraction, speed and agreement of two-pass against full inference"""
+    windows = sample_windows(src, COMPARE_SAMPLE_PATCHES)
+    patches = np.stack([read_patch(src, window, PATCH_SIZE) for window in windows])
+    reference, full_time = timed_predictions(model, patches, device, args.batch_size)
+
+    preds, skipped = [], 0
+    start = time.perf_counter()
+    for i in range(0, len(patches), args.batch_size):
+        batch_preds, _, coarse = predict_two_pass(
+            model,
+            patches[i : i + args.batch_size],
+            windows[i : i + args.batch_size],
+            device,
+            args,
+        )
+        preds.extend(batch_preds)
+        skipped += coarse
+    two_pass_time = time.perf_counter() - start
+
+    # Compare only pixels inside the raster, not the reflected padding
+    valid = np.zeros(reference.shape, bool)
+    for i, window in enumerate(windows):
+        valid[i, : window.height, : window.width] = True
+    preds = np.stack(preds)
+
+    print(f"Compared on {len(patches)} patches")
+    print(
+        f"Coarse pass settled {skipped}/{len(patches)} patches "
+        f"({skipped / len(patches):.1%})"
+    )
+    print(f"Full: {full_time:.2f}s, two-pass: {two_pass_time:.2f}s")
+    print(f"Speedup: {full_time / two_pass_time:.2f}x")
+    print_agreement(agreement_report(reference[valid], preds[valid]))
+
+
+def auto_batch_size(model, device, patch_size, max_batch_size=MAX_AUTO_BATCH_SIZE):
+    """Double the batch size until patches/s stops improving"""
+    best_size, best_rate = 1, 0.0
+    batch_size = 1
+    with torch.no_grad():
+        while batch_size <= max_batch_size:
+            batch = np.random.rand(batch_size, 4, patch_size, patch_size)
+            batch = batch.astype(np.float32)
+            try:
+                predict_batch(model, batch, device)  # warm up
+                start = time.perf_counter()
+                predict_batch(model, batch, device)
+                rate = batch_size / (time.perf_counter() - start)
+            except RuntimeError as e:  # out of memory
+                print(f"Batch size {batch_size} failed: {e}")
+                break
+
+            print(f"Batch size {batch_size}: {rate:.1f} patches/s")
+            if rate < best_rate * 1.05:
+                break
+            best_size, best_rate = batch_size, rate
+            batch_size *= 2
+
+    return best_size
+
+
+def sample_windows(src, num_patches, patch_size=PATCH_SIZE, phase=0.0):
+    """Up to num_patches non-empty windows spread evenly over the raster.
+
+    phase (0 to 1) shifts where sampling starts between two sampled windows,
+    so samples with different phases e.g. keep calibration and evaluation
+    patches apart.
+    """
+    windows = list(iter_windows(src.height, src.width, patch_size))
+    step = max(1, len(windows) // num_patches)
+    offset = int(phase * step)
+
+    sampled = []
+    for start in range(step):
+        for window in windows[(start + offset) % step :: step]:
+            if not is_nodata(src.read(window=window), src.nodata):
+                sampled.append(window)
+            if len(sampled) == num_patches:
+                return sampled
+
+    if not sampled:
+        raise ValueError("No non-empty patches to sample")
+    return sampled
+
+
+def sample_patches(src, num_patches, patch_size=PATCH_SIZE, phase=0.0):
+    """Read up to num_patches non-empty patches spread evenly over the raster"""
+    windows = sample_windows(src, num_patches, patch_size, phase)
+    return np.stack([read_patch(src, window, patch_size) for window in windows])
+
+
+def timed_predictions(model, patches, device, batch_size):
+    """Predict sample patches in batches and return (class indices, seconds)"""
+    preds = []
+    with torch.no_grad():
+        predict_batch(model, patches[:batch_size], device)  # warm up
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for i in range(0, len(patches), batch_size):
+            preds.append(predict_batch(model, patches[i : i + batch_size], device))
+        elapsed = time.perf_counter() - start
+    return np.concatenate(preds), elapsed
+
+
+def agreement_report(reference, candidate, num_classes=NUM_CLASSES):
+    """Overall and per-class agreement of candidate against reference predictions"""
+    report = {"overall": float(np.mean(reference == candidate)), "per_class": {}}
+    for class_id in range(num_classes):
+        mask = reference == class_id
+        if mask.any():
+            agreement = float(np.mean(candidate[mask] == class_id))
+            report["per_class"][class_id] = agreement
+    return report
+
+
+def per_class_iou(preds, reference, num_classes=NUM_CLASSES):
+    """IoU of preds against reference for each class, None if a class is absent"""
+    ious = []
+    for class_id in range(num_classes):
+        pred_mask = preds == class_id
+        ref_mask = reference == class_id
+        union = np.sum(pred_mask | ref_mask)
+        ious.append(np.sum(pred_mask & ref_mask) / union if union > 0 else None)
+    return ious
+
+
+def print_agreement(report):
+    print(f"Overall agreement: {report['overall']:.4f}")
+    for class_id, agreement in report["per_class"].items():
+        print(f"  Class {class_id}: {agreement:.4f}")
 
-    # Reconstruct full mask
-    pred_patches = np.array(preds).reshape(
-        image_padded.shape[0] // PATCH_SIZE,
-        image_padded.shape[1] // PATCH_SIZE,
-        PATCH_SIZE,
-        PATCH_SIZE,
+
+def compare_precision(model, src, device, batch_size, precision, channels_last):
+    """Time a reduced precision model against fp32 on a sample of patches"""
+    patches = sample_patches(src, COMPARE_SAMPLE_PATCHES)
+    baseline = PrecisionModel(model, device)
+    candidate = PrecisionModel(model, device, precision, channels_last)
+
+    reference, fp32_time = timed_predictions(baseline, patches, device, batch_size)
+    preds, candidate_time = timed_predictions(candidate, patches, device, batch_size)
+
+    print(f"Compared on {len(patches)} patches")
+    print(f"fp32: {fp32_time:.2f}s, {precision}: {candidate_time:.2f}s")
+    print(f"Speedup: {fp32_time / candidate_time:.2f}x")
+    print_agreement(agreement_report(reference, preds))
+
+
+class MapWriter:
+    """Writes predicted windows to the map and, if open, the confidence raster.
+
+    Windows are in input pixels, offset = (col, row) is where the output
+    starts in the input when it only covers a region of interest.
+    """
+
+    def __init__(self, dst, confidence_dst=None, offset=(0, 0)):
+        self.dst = dst
+        self.confidence_dst = confidence_dst
+        self.offset = offset
+        self.first_write = None
+
+    def write(self, window, pred, confidence=None):
+        if self.first_write is None:
+            self.first_write = time.time()
+        col, row = self.offset
+        window = Window(
+            window.col_off - col, window.row_off - row, window.width, window.height
+        )
+        self.dst.write(pred, 1, window=window)
+        if self.confidence_dst is not None and confidence is not None:
+            self.confidence_dst.write(confidence, 1, window=window)
+
+
+def open_output(stack, path, src, profile, mode):
+    """Open one output raster, update mode checks it lines up with the input"""
+    if mode == "r+":
+        dst = stack.enter_context(rasterio.open(path, "r+"))
+        if dst.shape != src.shape or dst.transform != src.transform:
+            raise ValueError(f"{path} is not on the same grid as {src.name}")
+        return dst
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return stack.enter_context(rasterio.open(path, "w", **profile))
+
+
+def open_writer(stack, src, args, windows=None):
+    """Open the map and confidence outputs and return a MapWriter for them.
+
+    windows is the region of interest, if any. A standalone region gets
+    rasters covering just the union of its windows, update mode rewrites
+    those windows of the existing full-size rasters.
+    """
+    profile = output_profile(src.profile, PATCH_SIZE)
+    offset = (0, 0)
+    mode = "w"
+    if windows is not None and args.roi_mode == "standalone":
+        extent = window_union(windows)
+        profile.update(
+            width=extent.width,
+            height=extent.height,
+            transform=src.window_transform(extent),
+        )
+        offset = (extent.col_off, extent.row_off)
+    elif windows is not None:
+        mode = "r+"
+
+    dst = open_output(stack, args.output, src, profile, mode)
+    confidence_dst = None
+    if args.confidence != "none":
+        confidence_mode = mode
+        if not os.path.exists(args.confidence_output):
+            confidence_mode = "w"
+        confidence_dst = open_output(
+            stack,
+            args.confidence_output,
+            src,
+            dict(profile, nodata=0),
+            confidence_mode,
+        )
+    return MapWriter(dst, confidence_dst, offset)
+
+
+def infer_windows(
+    model, src, windows, device, args, stats, cache=None, patch_size=PATCH_SIZE
+):
+    """Yield (window, uint8 prediction, uint8 confidence or None) per window.
+
+    With a PatchCache, patches seen before are answered from it and only
+    the misses of each batch go through the model.
+    """
+    prefetch = (args.prefetch_threads, args.prefetch_depth)
+    key_fn = cache.key if cache is not None else None
+    block_cache = open_block_cache(args)
+    windows = schedule_windows(windows, src, args.order, patch_size)
+    batches = read_batches(
+        src, windows, args.batch_size, stats, prefetch, patch_size, key_fn, block_cache
+    )
+    yield from predict_batches(model, batches, device, args, stats, cache)
+    if block_cache is not None:
+        stats["block_reads"] += block_cache.reads
+
+
+def predict_batches(model, batches, device, args, stats, cache=None):
+    """Predictions for the (batch, windows, keys) items of read_batches"""
+    with torch.no_grad():
+        for batch, batch_windows, keys in batches:
+            stats["patches"] += len(batch_windows)
+            if batch is None:
+                window = batch_windows[0]
+                fill = np.full((window.height, window.width), NODATA_CLASS, np.uint8)
+                stats["skipped"] += 1
+                yield window, fill, np.zeros_like(fill)
+                continue
+
+            if cache is not None:
+                misses = []
+                for i, (key, window) in enumerate(zip(keys, batch_windows)):
+                    hit = cache.get(key, (window.height, window.width))
+                    if hit is None:
+                        misses.append(i)
+                    else:
+                        yield window, hit[0], hit[1]
+                stats["cache_hits"] += len(batch_windows) - len(misses)
+                stats["cache_misses"] += len(misses)
+                if not misses:
+                    continue
+                if len(misses) < len(batch_windows):
+                    batch = batch[misses]
+                    batch_windows = [batch_windows[i] for i in misses]
+                    keys = [keys[i] for i in misses]
+
+            if args.two_pass:
+                preds, confidences, coarse = predict_two_pass(
+                    model, batch, batch_windows, device, args
+                )
+                stats["coarse_skipped"] += coarse
+            elif args.confidence == "none":
+                preds = predict_batch(model, batch, device)
+                confidences = [None] * len(preds)
+            else:
+                preds, confidences = predict_batch_confidence(
+                    model, batch, device, args.confidence
+                )
+
+            for i, (pred, confidence, window) in enumerate(
+                zip(preds, confidences, batch_windows)
+            ):
+                # Crop edge patches back to the window
+                pred = pred[: window.height, : window.width]
+                if confidence is not None:
+                    confidence = confidence[: window.height, : window.width]
+                if cache is not None:
+                    cache.put(keys[i], pred, confidence)
+                yield window, pred, confidence
+
+            if cache is not None:
+                cache.flush()
+
+
+def run_inference(
+    model, src, writer, device, args, windows=None, cache=None, patch_size=PATCH_SIZE
+):
+    """Predict windows (all of src by default) into writer and return patch counts"""
+    stats = new_stats()
+    if windows is None:
+        windows = iter_windows(src.height, src.width, patch_size)
+    for window, pred, confidence in infer_windows(
+        model, src, windows, device, args, stats, cache
+    ):
+        writer.write(window, pred, confidence)
+
+    return stats
+
+
+def row_bands(height, num_bands, patch_size=PATCH_SIZE):
+    """Split rows into at most num_bands PATCH_SIZE-aligned (top, bottom) bands"""
+    patch_rows = (height + patch_size - 1) // patch_size
+    rows_per_band = (patch_rows + num_bands - 1) // num_bands * patch_size
+    return [
+        (top, min(height, top + rows_per_band))
+        for top in range(0, height, rows_per_band)
+    ]
+
+
+def shard_worker(model, args, windows, device, threads, cache_mb, results):
+    """Infer one row band and send its predicted windows back to the parent"""
+    set_threads(*threads)
+    stats = new_stats()
+    windows = [Window(*window) for window in windows]
+    cache = open_cache(args)
+
+    with rasterio.Env(GDAL_CACHEMAX=cache_mb):
+        with rasterio.open(args.input) as src:
+            for window, pred, confidence in infer_windows(
+                model, src, windows, device, args, stats, cache
+            ):
+                results.put((window.flatten(), pred, confidence))
+
+    if cache is not None:
+        cache.close()
+
+    results.put(("done", stats, None))
+
+
+def run_sharded_inference(model, src, writer, device, args, threads, windows=None):
+    """Split the windows into row bands and infer each in its own process.
+
+    Torch weights are moved to shared memory once and handed to every worker
+    instead of being copied. The parent is the only process writing the
+    outputs: GDAL can't have several processes write one compressed GeoTIFF,
+    so the workers send back their disjoint windows and the parent writes them.
+    """
+    import torch.multiprocessing as mp
+
+    if isinstance(model, torch.nn.Module):
+        model.share_memory()
+
+    # spawn keeps workers clear of the parent's already started OpenMP pools
+    context = mp.get_context("spawn")
+    results = context.Queue(maxsize=4 * args.workers * args.batch_size)
+    if windows is None:
+        windows = list(iter_windows(src.height, src.width, PATCH_SIZE))
+    shards = [
+        [window.flatten() for window in windows if top <= window.row_off < bottom]
+        for top, bottom in row_bands(src.height, args.workers)
+    ]
+    shards = [shard for shard in shards if shard]
+    # Every worker gets an equal share of both caches
+    cache_mb = max(1, gdal_cache_mb(args) // len(shards))
+    worker_args = argparse.Namespace(**vars(args))
+    worker_args.block_cache_mb = args.block_cache_mb / len(shards)
+    workers = [
+        context.Process(
+            target=shard_worker,
+            args=(model, worker_args, shard, device, threads, cache_mb, results),
+        )
+        for shard in shards
+    ]
+    for worker in workers:
+        worker.start()
+    print(f"Started {len(workers)} workers with {threads[0]} threads each")
+
+    stats = new_stats()
+    done = 0
+    while done < len(workers):
+        try:
+            window, pred, confidence = results.get(timeout=5)
+        except queue.Empty:
+            if any(worker.exitcode not in (None, 0) for worker in workers):
+                for worker in workers:
+                    worker.terminate()
+                raise RuntimeError("An inference worker exited with an error")
+            continue
+
+        if window == "done":
+            for key, value in pred.items():
+                stats[key] += value
+            done += 1
+            continue
+
+        writer.write(Window(*window), pred, confidence)
+
+    for worker in workers:
+        worker.join()
+    return stats
+
+
+def blend_weights(patch_size, mode):
+    """2D weight map that favours patch centres over patch borders"""
+    x = np.arange(patch_size, dtype=np.float32)
+    if mode == "gaussian":
+        sigma = patch_size / 8
+        w = np.exp(-((x - (patch_size - 1) / 2) ** 2) / (2 * sigma**2))
+    else:
+        w = np.minimum(x + 1, patch_size - x)
+    w = w / w.max()
+
+    # Keep borders slightly above zero so image edges still get a prediction
+    return np.maximum(np.outer(w, w), 1e-3).astype(np.float32)
+
+
+def patch_origins(length, patch_size, stride):
+    """Patch offsets along one axis, the last patch is pulled back to the edge"""
+    if length <= patch_size:
+        return [0]
+    origins = list(range(0, length - patch_size, stride))
+    origins.append(length - patch_size)
+    return origins
+
+
+def run_blended_inference(model, src, writer, device, args, patch_size=PATCH_SIZE):
+    """Sliding-window inference with logits blended across overlapping patches.
+
+    Patch rows are processed top to bottom into a rolling buffer one patch
+    tall and as wide as the raster. Once a patch row is done, the rows above
+    the next patch row can no longer change, so they are argmaxed once and
+    written out before the buffer is shifted up.
+    """
+    stats = new_stats()
+    prefetch = (args.prefetch_threads, args.prefetch_depth)
+    stride = patch_size - args.overlap
+    weights = blend_weights(patch_size, args.blend)
+    rows = patch_origins(src.height, patch_size, stride)
+    cols = patch_origins(src.width, patch_size, stride)
+
+    # Rows stay in order for the rolling buffer, the block cache keeps the
+    # blocks shared by overlapping patch rows from being decompressed twice
+    block_cache = open_block_cache(args)
+
+    width = max(src.width, patch_size)
+    logits = np.zeros((NUM_CLASSES, patch_size, width), np.float32)
+    weight = np.zeros((patch_size, width), np.float32)
+    print(f"Blending buffer: {(logits.nbytes + weight.nbytes) / 1024**2:.0f} MB")
+
+    with torch.no_grad():
+        for i, top in enumerate(rows):
+            windows = [
+                Window(
+                    col,
+                    top,
+                    min(patch_size, src.width - col),
+                    min(patch_size, src.height - top),
+                )
+                for col in cols
+            ]
+            # Readers are started per patch row, every row must finish first
+            for batch, batch_windows, _ in read_batches(
+                src,
+                windows,
+                args.batch_size,
+                stats,
+                prefetch,
+                patch_size,
+                block_cache=block_cache,
+            ):
+                stats["patches"] += len(batch_windows)
+                if batch is None:
+                    stats["skipped"] += 1
+                    continue
+
+                output = predict_logits(model, batch, device).float().cpu().numpy()
+                for patch_logits, window in zip(output, batch_windows):
+                    col = window.col_off
+                    logits[:, :, col : col + patch_size] += patch_logits * weights
+                    weight[:, col : col + patch_size] += weights
+
+            # Rows above the next patch row are final
+            end = rows[i + 1] if i + 1 < len(rows) else src.height
+            n = end - top
+            block = logits[:, :n, : src.width]
+            covered = weight[:n, : src.width] > 0
+            pred = np.argmax(block, axis=0).astype(np.uint8)
+            pred[~covered] = NODATA_CLASS
+
+            confidence = None
+            if args.confidence != "none":
+                # Confidence needs the weighted mean, the argmax doesn't
+                mean = block / np.maximum(weight[:n, : src.width], 1e-6)
+                confidence = confidence_from_logits(
+                    torch.from_numpy(mean).unsqueeze(0), args.confidence
+                )[0].numpy()
+                confidence[~covered] = 0
+
+            writer.write(Window(0, top, src.width, n), pred, confidence)
+
+            logits[:, :-n] = logits[:, n:]
+            logits[:, -n:] = 0
+            weight[:-n] = weight[n:]
+            weight[-n:] = 0
+
+    if block_cache is not None:
+        stats["block_reads"] += block_cache.reads
+    return stats
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its largest finished child"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None, None
+
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+
+def set_threads(intra_op_threads, inter_op_threads):
+    """Size torch's thread pools, 0 leaves the library default"""
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        torch.set_num_interop_threads(inter_op_threads)
+
+
+def weight_paths(args):
+    """Files holding the weights args.backend runs, for the patch cache key"""
+    if args.backend == "torch":
+        paths = args.ensemble or [args.checkpoint]
+        return [
+            path if os.path.exists(path) else slim_checkpoint_path(path)
+            for path in paths
+        ]
+
+    path = args.onnx_path if args.backend == "onnx" else args.int8_path
+    # Large exports keep their weights in a separate external data file
+    return [p for p in [path, path + ".data"] if os.path.exists(p)]
+
+
+def weight_stamps(args):
+    """(path, mtime, size) of each weight file, to tell when one has changed"""
+    stamps = []
+    for path in weight_paths(args):
+        stat = os.stat(path)
+        stamps.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+    return stamps
+
+
+def open_cache(args):
+    """PatchCache for args, or None when it is disabled or can't be used"""
+    if args.no_cache or args.overlap:
+        return None
+
+    # The namespace hashes the files on disk, which must be the weights in use
+    if weight_stamps(args) != args.loaded_weights:
+        print("⚠ Weights changed on disk since they were loaded, not caching")
+        return None
+
+    from patch_cache import PatchCache
+
+    cache = PatchCache(args.cache_path, args.cache_budget_mb)
+    settings = {
+        "backend": args.backend,
+        "precision": args.precision,
+        "channels_last": args.channels_last,
+        "tta": args.tta,
+        "confidence": args.confidence,
+        "patch_size": PATCH_SIZE,
+        "num_classes": NUM_CLASSES,
+        "ensemble_weights": args.ensemble_weights if args.ensemble else None,
+        "two_pass": (
+            [args.coarse_factor, args.homogeneous_confidence] if args.two_pass else None
+        ),
+    }
+    cache.set_namespace(weight_paths(args), settings)
+    return cache
+
+
+def build_model(args, device):
+    """Return (model, checkpoint metadata, device, description) for args.backend"""
+    if args.backend in ["onnx", "int8"]:
+        # The INT8 model is a quantized copy of the ONNX export, see quantize.py
+        path = args.onnx_path if args.backend == "onnx" else args.int8_path
+        model = OnnxModel(path, args.intra_op_threads, args.inter_op_threads)
+        checkpoint = model.metadata
+        # Session outputs come back on the CPU
+        device = torch.device("cpu")
+        description = path
+    elif args.ensemble:
+        precision = resolve_precision(args.precision, device)
+        models, checkpoints = [], []
+        for path in args.ensemble:
+            model, checkpoint = load_model(path, device)
+            models.append(PrecisionModel(model, device, precision, args.channels_last))
+            checkpoints.append(checkpoint)
+        weights = ensemble_weights(args.ensemble_weights, checkpoints)
+        model = EnsembleModel(models, weights)
+        checkpoint = {
+            key: [c.get(key, "unknown") for c in checkpoints]
+            for key in ["epoch", "val_loss"]
+        }
+        # Slim checkpoints from before encoder_name was stored are all B4
+        checkpoint["encoder_name"] = [
+            c.get("encoder_name", ENCODER_NAME) for c in checkpoints
+        ]
+        description = (
+            f"{precision}, ensemble of {len(models)} weighted "
+            f"{', '.join(f'{w:.3f}' for w in model.weights)}"
+        )
+        description += ", channels_last" if args.channels_last else ""
+    else:
+        model, checkpoint = load_model(args.checkpoint, device)
+        precision = resolve_precision(args.precision, device)
+        model = PrecisionModel(model, device, precision, args.channels_last)
+        description = precision + (", channels_last" if args.channels_last else "")
+
+    if len(args.tta) > 1:
+        model = TTAModel(model, args.tta)
+        description += f", TTA {'/'.join(args.tta)}"
+    return model, checkpoint, device, description
+
+
+def profile_path(profile_dir=PROFILE_DIR):
+    """Per-machine autotune profile, see autotune.py"""
+    return os.path.join(profile_dir, f"{platform.node() or 'default'}.json")
+
+
+def load_profile(backend, precision, path=None):
+    """Tuned settings for this backend and precision, {} if there are none.
+
+    A profile written on different hardware or another torch version is
+    ignored, since its timings no longer apply.
+    """
+    path = path or profile_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        profile = json.load(f)
+
+    machine = profile.get("machine", {})
+    if machine.get("cpu_count") != os.cpu_count() or machine.get(
+        "torch"
+    ) != torch.__version__:
+        print(f"Ignoring {path}, it was tuned on other hardware or software")
+        return {}
+    tuned = profile.get("configs", {}).get(f"{backend}/{precision}", {})
+    return {key: value for key, value in tuned.items() if key in TUNED_SETTINGS}
+
+
+def given_options(parser, dests):
+    """Which of dests were set on the command line rather than by default"""
+    defaults = {dest: parser.get_default(dest) for dest in dests}
+    parser.set_defaults(**{dest: None for dest in dests})
+    given, _ = parser.parse_known_args()
+    parser.set_defaults(**defaults)
+    return {dest for dest in dests if getattr(given, dest) is not None}
+
+
+def apply_profile(parser, args):
+    """Replace defaults in args with tuned settings, explicit options still win.
+
+    Tuned workers only apply where sharding does. With --overlap, --compile
+    or another --workers they are dropped along with the thread counts tuned
+    for them.
+    """
+    tuned = load_profile(args.backend, args.precision)
+    given = given_options(parser, list(tuned))
+    workers = tuned.get("workers", 1)
+    if workers > 1 and ("workers" in given or args.overlap or args.compile):
+        print(f"Not using the tuned {workers} workers with this mode")
+        for key in ["workers", "intra_op_threads", "inter_op_threads"]:
+            tuned.pop(key, None)
+    tuned = {key: value for key, value in tuned.items() if key not in given}
+    if tuned:
+        print(f"Using autotuned settings {tuned} from {profile_path()}")
+        for key, value in tuned.items():
+            setattr(args, key, value)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the land cover map")
+    parser.add_argument("--input", default=RAW_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="patches per forward pass, 0 to pick automatically",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        default=OVERLAP,
+        help="sliding-window overlap in pixels, 0 for non-overlapping patches",
+    )
+    parser.add_argument("--blend", choices=BLEND_MODES, default=BLEND_MODES[0])
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="fp32")
+    parser.add_argument(
+        "--channels-last",
+        action="store_true",
+        help="run the model and its inputs in channels_last memory format",
+    )
+    parser.add_argument(
+        "--order",
+        choices=PATCH_ORDERS,
+        default=PATCH_ORDERS[0],
+        help="patch visiting order, hilbert follows the input's block layout",
+    )
+    parser.add_argument(
+        "--block-cache-mb",
+        type=float,
+        default=BLOCK_CACHE_MB,
+        help="decoded input blocks to keep, 0 to leave caching to GDAL alone",
+    )
+    parser.add_argument(
+        "--ensemble",
+        nargs="+",
+        metavar="CHECKPOINT",
+        help="average the logits of these checkpoints instead of --checkpoint",
+    )
+    parser.add_argument(
+        "--ensemble-weights",
+        default="mean",
+        help="mean, val_loss (1 / val_loss of each checkpoint) "
+        "or comma separated weights",
+    )
+    parser.add_argument(
+        "--two-pass",
+        action="store_true",
+        help="fill patches a downsampled pass finds homogeneous, infer the rest",
+    )
+    parser.add_argument(
+        "--coarse-factor", type=int, choices=COARSE_FACTORS, default=COARSE_FACTOR
+    )
+    parser.add_argument(
+        "--homogeneous-confidence",
+        type=float,
+        default=HOMOGENEOUS_CONFIDENCE,
+        help="lowest coarse top-1 probability for a patch to count as homogeneous",
+    )
+    parser.add_argument(
+        "--compare-two-pass",
+        action="store_true",
+        help="report skipped fraction, speed and agreement of --two-pass, then exit",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="run the model through torch.compile for a fixed batch size",
+    )
+    parser.add_argument("--compile-cache-dir", default=COMPILE_CACHE_DIR)
+    parser.add_argument(
+        "--compare-precision",
+        action="store_true",
+        help="report speed and agreement of --precision against fp32, then exit",
     )
-    full_mask = unpatchify(pred_patches, image_padded.shape[:2])
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument("--onnx-path", default=ONNX_PATH)
+    parser.add_argument("--int8-path", default=INT8_ONNX_PATH)
+    parser.add_argument(
+        "--intra-op-threads",
+        type=int,
+        default=0,
+        help="threads used inside an operator, 0 for the library default",
+    )
+    parser.add_argument(
+        "--inter-op-threads",
+        type=int,
+        default=0,
+        help="threads used across independent operators, 0 for the default",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="processes for sharded inference, threads are split between them",
+    )
+    parser.add_argument(
+        "--prefetch-threads",
+        type=int,
+        default=PREFETCH_THREADS,
+        help="background threads reading patches, 0 to read on the main thread",
+    )
+    parser.add_argument(
+        "--prefetch-depth",
+        type=int,
+        default=PREFETCH_DEPTH,
+        help="batches the readers may get ahead of the model",
+    )
+    parser.add_argument(
+        "--confidence",
+        choices=CONFIDENCE_MODES,
+        default="none",
+        help="also write top-1 probability or top-1/top-2 margin as uint8",
+    )
+    parser.add_argument("--confidence-output", default=CONFIDENCE_PATH)
+    parser.add_argument(
+        "--tta",
+        type=parse_tta,
+        default="none",
+        help=f"test-time augmentation, one of {list(TTA_PRESETS)} "
+        "or comma separated transforms",
+    )
+    roi = parser.add_mutually_exclusive_group()
+    roi.add_argument(
+        "--roi",
+        type=resolve_boundary,
+        help="only infer patches intersecting this boundary .gpkg, "
+        f"by path or by name under {BOUNDARIES_DIR}",
+    )
+    roi.add_argument(
+        "--roi-bbox",
+        type=parse_bbox,
+        help="only infer patches intersecting min_lon,min_lat,max_lon,max_lat",
+    )
+    parser.add_argument(
+        "--roi-mode",
+        choices=ROI_MODES,
+        default=ROI_MODES[0],
+        help="write the region to its own raster or update --output in place",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="keep the model loaded and run jobs posted to a localhost port",
+    )
+    parser.add_argument("--port", type=int, default=DAEMON_PORT)
+    parser.set_defaults(windows=None)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always run the model instead of reusing cached patch predictions",
+    )
+    parser.add_argument("--cache-path", default=CACHE_PATH)
+    parser.add_argument("--cache-budget-mb", type=float, default=CACHE_BUDGET_MB)
+    parser.add_argument(
+        "--stats-json",
+        help="write patch counts, timings and peak memory to this file",
+    )
+    parser.add_argument(
+        "--no-profile",
+        action="store_true",
+        help="ignore this machine's autotune profile",
+    )
+
+    args = parser.parse_args()
+    if not args.no_profile:
+        apply_profile(parser, args)
+
+    if not 0 <= args.overlap < PATCH_SIZE:
+        parser.error(f"--overlap must be between 0 and {PATCH_SIZE - 1}")
+    if args.backend != "torch" and (args.precision != "fp32" or args.channels_last):
+        parser.error("--precision and --channels-last only apply to --backend torch")
+    if args.backend != "torch" and args.compare_precision:
+        parser.error("--compare-precision only applies to --backend torch")
+    if args.backend != "torch" and args.compile:
+        parser.error("--compile only applies to --backend torch")
+    if args.ensemble and (args.backend != "torch" or args.compare_precision):
+        parser.error("--ensemble needs --backend torch, without --compare-precision")
+    if args.compare_two_pass:
+        args.two_pass = True
+    if args.two_pass and args.backend != "torch":
+        parser.error("--two-pass needs --backend torch, ONNX exports have a fixed size")
+    if args.two_pass and args.overlap:
+        parser.error("--two-pass can't be combined with --overlap yet")
+    if args.two_pass and args.compile:
+        # The coarse pass would trigger a second compile for its smaller shape
+        parser.error("--two-pass can't be combined with --compile yet")
+    if args.compile and args.workers > 1:
+        parser.error("--compile can't be combined with --workers yet")
+    if args.prefetch_depth < 1:
+        parser.error("--prefetch-depth must be at least 1")
+    if args.workers > 1 and args.overlap:
+        parser.error("--workers can't be combined with --overlap yet")
 
-    # Crop back to original size
-    full_mask = full_mask[:orig_h, :orig_w]
+    if args.serve and args.compare_precision:
+        parser.error("--serve can't be combined with --compare-precision")
 
-    # Save as GeoTIFF with metadata
-    profile.update(dtype=rasterio.uint8, count=1, compress="lzw")
+    try:
+        prepare_region(args)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
 
-    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-    with rasterio.open(OUTPUT_PATH, "w", **profile) as dst:
-        dst.write(full_mask.astype(np.uint8), 1)
+
+def region_name(args):
+    """Short name of the region of interest, None when inferring everything"""
+    if args.windows:
+        return "windows"
+    if args.roi:
+        return os.path.splitext(os.path.basename(args.roi))[0]
+    if args.roi_bbox:
+        return "bbox"
+    return None
+
+
+def prepare_region(args):
+    """Check the region options and pick region output paths, in place"""
+    name = region_name(args)
+    if name is None:
+        return
+    if args.overlap:
+        raise ValueError("a region of interest can't be combined with --overlap yet")
+    if args.roi_mode == "update" and not os.path.exists(args.output):
+        raise ValueError(f"--roi-mode update needs an existing map at {args.output}")
+
+    # A standalone region must not overwrite the full map by default
+    if args.roi_mode == "standalone" and args.output == OUTPUT_PATH:
+        args.output = os.path.join(ROI_OUTPUT_DIR, f"{name}.tif")
+        if args.confidence_output == CONFIDENCE_PATH:
+            args.confidence_output = os.path.join(
+                ROI_OUTPUT_DIR, f"{name}.confidence.tif"
+            )
+
+
+def region_windows(src, args):
+    """Windows to infer for args, None for the whole raster"""
+    if args.windows:
+        windows = [Window(*window) for window in args.windows]
+        for window in windows:
+            if (
+                window.col_off < 0
+                or window.row_off < 0
+                or window.col_off + window.width > src.width
+                or window.row_off + window.height > src.height
+                or window.width > PATCH_SIZE
+                or window.height > PATCH_SIZE
+            ):
+                raise ValueError(f"{window} is not a patch window of {src.name}")
+        return windows
+
+    if not (args.roi or args.roi_bbox):
+        return None
+    windows = roi_windows(src, roi_geometry(args, src.crs))
+    if not windows:
+        raise ValueError(f"The region of interest doesn't overlap {src.name}")
+    return windows
+
+
+def run_job(model, checkpoint, device, description, args, threads):
+    """Infer args.input (or its region) into args.output and return the stats"""
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(rasterio.Env(GDAL_CACHEMAX=gdal_cache_mb(args)))
+        src = stack.enter_context(rasterio.open(args.input))
+
+        windows = region_windows(src, args)
+        if windows is not None:
+            total = -(-src.height // PATCH_SIZE) * -(-src.width // PATCH_SIZE)
+            print(f"Region of interest covers {len(windows)}/{total} patches")
+
+        writer = open_writer(stack, src, args, windows)
+        dst = writer.dst
+        confidence_dst = writer.confidence_dst
+
+        # Sharded workers open their own connection to the cache
+        cache = open_cache(args)
+        if cache is not None:
+            stack.callback(cache.close)
+
+        start = time.perf_counter()
+        if args.workers > 1:
+            stats = run_sharded_inference(
+                model, src, writer, device, args, threads, windows
+            )
+        elif args.overlap:
+            stats = run_blended_inference(model, src, writer, device, args)
+        else:
+            stats = run_inference(model, src, writer, device, args, windows, cache)
+        stats["inference_s"] = time.perf_counter() - start
+        stats["first_write_time"] = writer.first_write
+        stats["pixels"] = src.width * src.height
+        if windows is not None:
+            stats["pixels"] = sum(window.width * window.height for window in windows)
+        stats["peak_rss_mb"], stats["peak_child_rss_mb"] = peak_rss_mb()
+        if isinstance(model, CompiledModel):
+            stats["compile_s"] = model.compile_s
+        print_stats(stats)
+
+        if cache is not None:
+            removed, total = cache.evict()
+            print(
+                f"Patch cache: {total / 1024**2:.0f} MB at {args.cache_path}, "
+                f"evicted {removed} entries"
+            )
 
         # Add metadata
+        encoders = checkpoint.get("encoder_name", ENCODER_NAME)
+        if isinstance(encoders, list):
+            encoders = ", ".join(dict.fromkeys(encoders))
         metadata = {
-            "MODEL": "U-Net (EfficientNet-B4 backbone)",
+            "MODEL": f"U-Net ({encoders} backbone)",
             "NUM_CLASSES": str(NUM_CLASSES),
             "CLASS_MAPPING": str(class_mapping),
             "TRAIN_EPOCH": str(checkpoint.get("epoch", "unknown")),
             "VAL_LOSS": str(checkpoint.get("val_loss", "unknown")),
+            "BACKEND": f"{args.backend} ({description})",
             "GENERATED": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         }
+        if windows is not None:
+            roi = args.roi or region_name(args)
+            if args.roi_bbox:
+                roi = ",".join(str(v) for v in args.roi_bbox)
+            # An updated map keeps the GENERATED time of its last full run
+            if args.roi_mode == "update":
+                metadata["ROI_UPDATED"] = metadata.pop("GENERATED")
+            metadata["ROI"] = roi
         dst.update_tags(**metadata)
+        if confidence_dst is not None:
+            confidence_dst.update_tags(
+                **metadata, CONFIDENCE=args.confidence, SCALE="value / 255"
+            )
+
+    print(f"Landcover map saved at {args.output} with metadata")
+    if args.confidence != "none":
+        print(f"Confidence ({args.confidence}) saved at {args.confidence_output}")
+
+    if args.stats_json:
+        with open(args.stats_json, "w") as f:
+            json.dump(dict(stats, batch_size=args.batch_size), f, indent=2)
+    return stats
+
+
+def job_args(base_args, job):
+    """Copy of the daemon's args with a job's options applied and checked"""
+    unknown = set(job) - set(JOB_OPTIONS)
+    if unknown:
+        raise ValueError(f"unknown job options {sorted(unknown)}, use {JOB_OPTIONS}")
+
+    args = argparse.Namespace(**vars(base_args))
+    for option, value in job.items():
+        setattr(args, option, value)
+
+    try:
+        if job.get("roi"):
+            args.roi = resolve_boundary(args.roi)
+        if job.get("roi_bbox"):
+            bbox = args.roi_bbox
+            if not isinstance(bbox, str):
+                bbox = ",".join(str(v) for v in bbox)
+            args.roi_bbox = parse_bbox(bbox)
+    except argparse.ArgumentTypeError as e:
+        raise ValueError(str(e))
+    if args.confidence not in CONFIDENCE_MODES:
+        raise ValueError(f"confidence must be one of {CONFIDENCE_MODES}")
+    if args.roi_mode not in ROI_MODES:
+        raise ValueError(f"roi_mode must be one of {ROI_MODES}")
+    if not isinstance(args.batch_size, int) or args.batch_size < 1:
+        raise ValueError("batch_size must be a positive integer")
+    if args.windows and not all(
+        isinstance(window, (list, tuple)) and len(window) == 4
+        for window in args.windows
+    ):
+        raise ValueError("windows must be [col_off, row_off, width, height] lists")
+    prepare_region(args)
+    return args
+
+
+def prepare_model(args, device):
+    """build_model plus the batch size, compiling and two-pass on top of it.
+
+    Records the weight files as they were when loaded in args.loaded_weights.
+    """
+    args.loaded_weights = weight_stamps(args)
+    model, checkpoint, device, description = build_model(args, device)
+    print(f"Running {args.backend} backend ({description})")
+
+    if args.batch_size <= 0:
+        args.batch_size = auto_batch_size(model, device, PATCH_SIZE)
+    print(f"Using batch size {args.batch_size}")
+
+    if args.compile:
+        model = compile_model(model, args, device)
+        description += ", compiled"
+    if args.two_pass:
+        description += f", two-pass at 1/{args.coarse_factor}"
+    return model, checkpoint, device, description
+
+
+def serve_jobs(model, checkpoint, device, description, args, threads):
+    """Keep the model loaded and run jobs posted to the daemon, see daemon.py.
+
+    Jobs run on the options the daemon was started with plus the per-job
+    JOB_OPTIONS. When the weight files change on disk, e.g. after train.py,
+    the model is reloaded before the next job so it never predicts, or
+    caches, with the old weights.
+    """
+    loaded = [model, checkpoint, device, description]
+
+    def run(job):
+        if weight_stamps(args) != args.loaded_weights:
+            print("♻ Weights changed on disk, reloading the model")
+            loaded[:] = prepare_model(args, loaded[2])
+            status["backend"] = f"{args.backend} ({loaded[3]})"
+        # The job's args were copied from the daemon's before any reload
+        job.loaded_weights = args.loaded_weights
+        stats = run_job(*loaded, job, threads)
+        return {
+            "output": os.path.abspath(job.output),
+            "confidence_output": (
+                os.path.abspath(job.confidence_output)
+                if job.confidence != "none"
+                else None
+            ),
+            "stats": stats,
+        }
+
+    status = {
+        "backend": f"{args.backend} ({description})",
+        "batch_size": args.batch_size,
+    }
+    serve(lambda job: job_args(args, job), run, status, args.port)
+
+
+def main():
+    args = parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    # Split the cores between workers unless the thread count is set explicitly
+    threads = (args.intra_op_threads, args.inter_op_threads)
+    if args.workers > 1 and args.intra_op_threads <= 0:
+        threads = (max(1, (os.cpu_count() or 1) // args.workers), 1)
+        args.intra_op_threads, args.inter_op_threads = threads
+    set_threads(*threads)
+
+    if args.compare_precision:
+        model, _ = load_model(args.checkpoint, device)
+        precision = resolve_precision(args.precision, device)
+        batch_size = args.batch_size if args.batch_size > 0 else BATCH_SIZE
+        with rasterio.open(args.input) as src:
+            compare_precision(
+                model, src, device, batch_size, precision, args.channels_last
+            )
+        return
+
+    # Load model
+    try:
+        model, checkpoint, device, description = prepare_model(args, device)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.compare_two_pass:
+        with rasterio.open(args.input) as src:
+            compare_two_pass(model, src, device, args)
+        return
+
+    if args.serve:
+        # Pay for the first, slowest forward pass before any job arrives
+        with torch.no_grad():
+            warmup = np.zeros((args.batch_size, 4, PATCH_SIZE, PATCH_SIZE), np.float32)
+            predict_batch(model, warmup, device)
+        serve_jobs(model, checkpoint, device, description, args, threads)
+        return
 
-    print(f"Landcover map saved at {OUTPUT_PATH} with metadata")
+    try:
+        run_job(model, checkpoint, device, description, args, threads)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":